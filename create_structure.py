@@ -19,11 +19,17 @@ def create_project_structure():
         "docs"
     ]
     
-    # Создаем директории
+    # Создаем директории: общие префиксы (например, data/) создаются один раз
+    base_dir.mkdir(parents=True, exist_ok=True)
+    seendirs = set()
     for directory in directories:
-        dir_path = base_dir / directory
-        dir_path.mkdir(parents=True, exist_ok=True)
-        print(f"✅ Создана папка: {dir_path}")
+        relative = Path(directory)
+        for parent in reversed((relative, *relative.parents[:-1])):
+            if parent in seendirs:
+                continue
+            seendirs.add(parent)
+            (base_dir / parent).mkdir(exist_ok=True)
+        print(f"✅ Создана папка: {base_dir / relative}")
     
     # Создаем файлы с содержимым (адаптировано для Windows)
     files_content = {
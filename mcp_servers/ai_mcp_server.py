@@ -1,61 +1,463 @@
 import asyncio
+import hashlib
 import json
+import os
 import uvicorn
 import time
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 import chromadb
-from sentence_transformers import SentenceTransformer
+from chromadb.config import Settings
+import httpx
+import numpy as np
 from pathlib import Path
 import logging
-import ollama
-from ollama import Client as OllamaClient
+from ollama import AsyncClient as OllamaAsyncClient, Client as OllamaClient
 
-# Настройка логирования
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# Настройка логирования: LOG_LEVEL=DEBUG включает построчный лог каждого запроса
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+# ONNX Runtime с динамической int8-квантизацией; EMBEDDING_BACKEND=torch возвращает FP32 PyTorch,
+# EMBEDDING_BACKEND=openvino - OpenVINO (процессоры Intel),
+# EMBEDDING_BACKEND=model2vec - статическую дистилляцию модели (scripts/distill_embedder.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+EMBEDDING_STATIC_MODEL = os.getenv(
+    "EMBEDDING_STATIC_MODEL",
+    str(Path(__file__).parent.parent / "data" / "m2v-mini")
+)
+# EMBEDDING_COMPILE=1: torch.compile для PyTorch-бэкенда (долгий первый запуск, быстрее encode)
+EMBEDDING_COMPILE = os.getenv("EMBEDDING_COMPILE", "0") == "1"
+# Размерность статической модели другая, поэтому ее векторы хранятся в отдельной коллекции
+COLLECTION_NAME = "rag_memory_m2v" if EMBEDDING_BACKEND == "model2vec" else "rag_memory"
+
+# Микробатчинг запросов к эмбеддеру: окно накопления и максимальный размер пакета
+EMBED_BATCH_WINDOW = 0.005
+EMBED_BATCH_MAX_SIZE = 64
+# Предел тела запроса с Content-Encoding: gzip - и сжатого, и после распаковки, байт
+GZIP_MAX_BODY_SIZE = int(os.getenv("GZIP_MAX_BODY_SIZE", str(32 * 1024 * 1024)))
+
+# Размеры LRU-кэшей ответов /rag и эмбеддингов запросов.
+# Кэш /rag локален для процесса, поэтому при нескольких воркерах он отключается (0)
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+# Семантический кэш /rag: перефразированный вопрос с косинусной близостью не ниже порога
+# получает сохраненный ответ без поиска и генерации. Кэш общий для всех клиентов сервера,
+# а близкие по эмбеддингу вопросы могут различаться по смыслу, поэтому он включается явно
+# (SEMANTIC_CACHE_SIZE=1024); по умолчанию 0 - отключен
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "0"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Эмбеддинги документов по ID (~1.5KB на вектор): повторная загрузка после /clear не эмбеддится
+DOCUMENT_EMBEDDING_CACHE_SIZE = 10_000
+
+# Параметры HNSW для новой коллекции: search_ef по умолчанию (10) дает низкий recall
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 16,
+    "hnsw:search_ef": 64
+}
+
+# Размер окна документов, которое /batch_add и /batch_add_stream эмбеддят и пишут за один раз
+STREAM_BATCH_SIZE = 512
+
+# Модель остается загруженной в Ollama между запросами, HTTP-соединения переиспользуются
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_TIMEOUT = httpx.Timeout(120.0, connect=2.0)
+OLLAMA_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+# Окно контекста RAG-генерации: KV-кэш выделяется под num_ctx, а не под умолчание модели.
+# Одно значение во всех RAG-вызовах, иначе Ollama перезагружает модель с новым окном
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+# Модель иногда продолжает ответ выдуманным следующим вопросом: генерация на нем обрывается
+RAG_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "stop": ["\nВОПРОС:"]}
+# Бюджет контекста в символах, чтобы промпт гарантированно помещался в окно:
+# документы берутся целиком, не поместившиеся отбрасываются
+RAG_CONTEXT_MAX_CHARS = 3000
+# Переранжирование кросс-энкодером (пусто - отключено): из RERANK_CANDIDATES ближайших
+# по эмбеддингам в промпт идут top_k самых релевантных. Модель должна понимать русский
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_CANDIDATES = 20
+# Найденный документ, почти совпадающий с более релевантным (косинус выше порога), в промпт не идет
+RAG_DEDUP_THRESHOLD = 0.92
+# Модель, для которой при старте заранее считается KV-кэш системного RAG-промпта (пусто - не прогревать)
+OLLAMA_WARMUP_MODEL = os.getenv("OLLAMA_WARMUP_MODEL", "llama3.2:3b")
+# Период обновления списка моделей (новые модели видны без перезапуска сервера)
+MODELS_REFRESH_INTERVAL = 60
+
+# Число процессов сервера (задает gunicorn.conf.py): ядра делятся между ними
+MCP_WORKERS = max(1, int(os.getenv("MCP_WORKERS", "1")))
+
+# Unix-сокет вместо TCP для клиентов на той же машине (клиент читает ту же переменную)
+MCP_UDS = os.getenv("MCP_UDS")
+
+# Неизменная часть RAG-промпта передается как system: Ollama переиспользует
+# KV-кэш общего префикса между запросами и не пересчитывает его
+RAG_SYSTEM_PROMPT = """Ты - полезный AI-ассистент с доступом к базе знаний. 
+Твоя задача - отвечать на вопросы пользователя, используя предоставленный контекст.
+
+ИНСТРУКЦИИ:
+1. Отвечай ТОЛЬКО на русском языке
+2. Используй информацию из контекста, если она есть
+3. Если информации в контексте НЕТ, скажи "Информация по данному вопросу отсутствует в базе знаний"
+4. Не добавляй информацию, которой нет в контексте"""
+
+RAG_PROMPT_TEMPLATE = """КОНТЕКСТ:
+{context}
+
+ВОПРОС: {query}
+
+ОТВЕТ:"""
+
+
+def _fit_context(documents: List[str], max_chars: int = RAG_CONTEXT_MAX_CHARS) -> str:
+    """Документы целиком, пока помещаются в бюджет; слишком длинный первый режется по границе слова"""
+    parts, size = [], 0
+    for document in documents:
+        size += len(document) + (1 if parts else 0)
+        if size > max_chars:
+            break
+        parts.append(document)
+    if not parts and documents:
+        head = documents[0][:max_chars]
+        cut = head.rfind(" ")
+        return head[:cut] if cut > 0 else head
+    return "\n".join(parts)
+
+
+def _compile_transformer(embedder: "SentenceTransformer") -> None:
+    """torch.compile трансформера PyTorch-бэкенда; граф захватывается прогревочным encode"""
+    import torch
+    module = embedder[0]
+    if not hasattr(module, "auto_model"):
+        return
+    original = module.auto_model
+    try:
+        module.auto_model = torch.compile(original, dynamic=True)
+        embedder.encode(["warmup"])
+    except Exception as e:
+        module.auto_model = original
+        logger.warning(f"torch.compile недоступен ({e}), модель работает без компиляции")
+
+
+def _configure_threads() -> int:
+    """Единый бюджет потоков процесса для OpenMP, MKL, OpenBLAS, PyTorch и ONNX Runtime"""
+    # Ядра поровну между воркерами, без переподписки CPU; явно заданные переменные не меняются
+    threads = max(1, (os.cpu_count() or 1) // MCP_WORKERS)
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(name, str(threads))
+    # Переменные выше читаются при загрузке библиотек, поэтому torch импортируется после них
+    import torch
+    torch.set_num_threads(threads)
+    return threads
+
+
+@lru_cache(maxsize=1)
+def get_embedder(model_name: str = EMBEDDING_MODEL) -> "SentenceTransformer":
+    """Загрузка модели эмбеддингов один раз на процесс"""
+    # torch и sentence_transformers загружаются только здесь: импорт модуля остается быстрым
+    threads = _configure_threads()
+    import torch
+    from sentence_transformers import SentenceTransformer
+    embedder = None
+    if EMBEDDING_BACKEND == "model2vec":
+        # Таблица эмбеддингов токенов и усреднение вместо прохода по слоям трансформера
+        from sentence_transformers.models import StaticEmbedding
+        embedder = SentenceTransformer(modules=[StaticEmbedding.from_model2vec(EMBEDDING_STATIC_MODEL)])
+    elif torch.cuda.is_available():
+        # На GPU FP16 PyTorch быстрее int8 ONNX на CPU
+        embedder = SentenceTransformer(model_name, device="cuda")
+        embedder.half()
+    elif EMBEDDING_BACKEND == "onnx":
+        try:
+            # Пул потоков ONNX Runtime того же размера, что и у PyTorch
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = threads
+            embedder = SentenceTransformer(
+                model_name,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE, "session_options": session_options}
+            )
+        except Exception as e:
+            logger.warning(f"ONNX бэкенд недоступен ({e}), используется PyTorch")
+    elif EMBEDDING_BACKEND == "openvino":
+        try:
+            embedder = SentenceTransformer(model_name, backend="openvino")
+        except Exception as e:
+            logger.warning(f"OpenVINO бэкенд недоступен ({e}), используется PyTorch")
+    if embedder is None:
+        embedder = SentenceTransformer(model_name)
+    if EMBEDDING_COMPILE and embedder.backend == "torch":
+        _compile_transformer(embedder)
+    # Прогрев: ленивая инициализация BLAS/CUDA не должна попасть на первый запрос
+    embedder.encode(["warmup"])
+    logger.info(f"Модель эмбеддингов загружена: {model_name} ({embedder.backend}, {embedder.device})")
+    return embedder
+
+
+@lru_cache(maxsize=1)
+def get_reranker():
+    """Кросс-энкодер для переранжирования, загружается при первом запросе"""
+    from sentence_transformers import CrossEncoder
+    reranker = CrossEncoder(RERANK_MODEL, max_length=256)
+    logger.info(f"Модель переранжирования загружена: {RERANK_MODEL}")
+    return reranker
+
+
+def _doc_id(text: str) -> str:
+    """Стабильный между перезапусками ID документа по его содержимому"""
+    return "doc_" + hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _distinct_documents(documents: List[str], embeddings) -> List[str]:
+    """Документы в порядке релевантности без почти повторов уже взятых"""
+    if len(documents) < 2 or len(embeddings) != len(documents):
+        return list(documents)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept = []
+    for i in range(len(documents)):
+        if all(vectors[i] @ vectors[j] <= RAG_DEDUP_THRESHOLD for j in kept):
+            kept.append(i)
+    return [documents[i] for i in kept]
+
+
+def _elapsed(start_ns: int) -> float:
+    """Секунды, прошедшие с отметки time.perf_counter_ns()"""
+    return (time.perf_counter_ns() - start_ns) / 1e9
+
+
+def _timing_enabled(request) -> bool:
+    """Тайминги возвращаются в ответе только по запросу клиента или в режиме DEBUG"""
+    return request.profile or logger.isEnabledFor(logging.DEBUG)
+
+
+def _model_names(models_response) -> frozenset:
+    """Имена моделей из ответа Ollama list()"""
+    names = []
+    for model in models_response['models']:
+        if 'name' in model:
+            names.append(model['name'])
+        elif 'model' in model:
+            names.append(model['model'])
+    return frozenset(names)
+
+
+class LRUCache:
+    """Простой LRU-кэш на OrderedDict"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+class SemanticCache:
+    """Кэш ответов по близости эмбеддингов запросов: кольцевой буфер нормированных векторов"""
+
+    def __init__(self, max_size: int, threshold: float):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.clear()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding, key):
+        """Ответ на самый близкий запрос с тем же ключом (модель, top_k) или None"""
+        if self._vectors is None:
+            return None
+        # Одно матрично-векторное произведение по всему буферу; пустые строки дают 0
+        scores = self._vectors @ self._normalize(embedding)
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for i in candidates[np.argsort(-scores[candidates])]:
+            entry = self._entries[i]
+            if entry is not None and entry[0] == key:
+                return entry[1]
+        return None
+
+    def put(self, embedding, key, value):
+        if not self.max_size:
+            return
+        vector = self._normalize(embedding)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+        self._vectors[self._next] = vector
+        self._entries[self._next] = (key, value)
+        self._next = (self._next + 1) % self.max_size
+
+    def clear(self):
+        self._vectors = None
+        self._entries = [None] * self.max_size
+        self._next = 0
+
+
+class GzipRequestMiddleware:
+    """Распаковка тел запросов с Content-Encoding: gzip (клиент сжимает крупные документы)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in scope["headers"]:
+            await self.app(scope, receive, send)
+            return
+        
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > GZIP_MAX_BODY_SIZE:
+                await self._reject(scope, receive, send, 413, "Request body too large")
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        
+        # Распаковка с ограничением размера результата: маленькое тело не раздувается
+        # в гигабайты в памяти (gzip-бомба)
+        try:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            body = decompressor.decompress(b"".join(chunks), GZIP_MAX_BODY_SIZE + 1)
+            if len(body) > GZIP_MAX_BODY_SIZE or decompressor.unconsumed_tail:
+                await self._reject(scope, receive, send, 413, "Decompressed body too large")
+                return
+            if not decompressor.eof:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        except (zlib.error, OSError, EOFError) as e:
+            await self._reject(scope, receive, send, 400, f"Invalid gzip body: {e}")
+            return
+        
+        headers = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        headers.append((b"content-length", str(len(body)).encode()))
+        
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        
+        await self.app({**scope, "headers": headers}, receive_body, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str):
+        response = ORJSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
+
 # ==================== МОДЕЛИ ДАННЫХ ====================
 
-class SearchRequest(BaseModel):
+
+class RequestModel(BaseModel):
+    """Базовая модель запросов: неизменяемая, лишние поля отбрасываются"""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+
+class SearchRequest(RequestModel):
     query: str
     top_k: int = 3
+    profile: bool = False
+
 
-class DocumentAddRequest(BaseModel):
+class DocumentAddRequest(RequestModel):
     text: str
     metadata: Optional[Dict[str, Any]] = None
 
-class GenerateRequest(BaseModel):
+
+class GenerateRequest(RequestModel):
     model: str = "llama3.2:3b"
     prompt: str
     options: Optional[Dict[str, Any]] = None
+    stream: bool = False
+    profile: bool = False
 
-class ChatMessage(BaseModel):
+
+class ChatMessage(RequestModel):
     role: str
     content: str
 
-class ChatRequest(BaseModel):
+
+class ChatRequest(RequestModel):
     model: str = "llama3.2:3b"
     messages: List[ChatMessage]
 
-class RAGRequest(BaseModel):
+
+class RAGRequest(RequestModel):
     query: str
     model: str = "llama3.2:3b"
     top_k: int = 3
+    stream: bool = False
+    profile: bool = False
+
+
+class RAGBatchRequest(RequestModel):
+    queries: List[str]
+    model: str = "llama3.2:3b"
+    top_k: int = 3
+    profile: bool = False
 
 # ==================== ОСНОВНОЙ СЕРВЕР ====================
 
+
 class AIMCPServer:
     def __init__(self):
         self.app = FastAPI(
             title="AI MCP Server",
             description="MCP-сервер для векторной БД и LLM моделей",
-            version="2.0.0"
+            version="2.0.0",
+            default_response_class=ORJSONResponse
         )
+        self.app.add_middleware(GzipRequestMiddleware)
+        # Пул для блокирующих вызовов (эмбеддинги, ChromaDB), чтобы не держать event loop
+        self._pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        # Очередь создается лениво внутри работающего event loop
+        self._embed_queue = None
+        self._embed_task = None
+        self._search_queue = None
+        self._search_task = None
+        self._query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        self._document_embedding_cache = LRUCache(DOCUMENT_EMBEDDING_CACHE_SIZE)
+        # Ответы /rag зависят от содержимого БД: кэш сбрасывается при любой записи
+        self._rag_cache = LRUCache(RAG_CACHE_SIZE)
+        self._semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
         
         self._init_vector_db()
         self._init_llm_client()
@@ -68,43 +470,296 @@ class AIMCPServer:
         try:
             base_dir = Path(__file__).parent.parent
             db_path = base_dir / "data" / "chroma_db"
-            self.client = chromadb.PersistentClient(path=str(db_path))
-            self.collection = self.client.get_or_create_collection("rag_memory")
-            self.embedder = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+            self.client = chromadb.PersistentClient(
+                path=str(db_path),
+                settings=Settings(anonymized_telemetry=False)
+            )
+            # Параметры HNSW задаются только при создании коллекции; существующая сохраняет свои
+            self.collection = self.client.get_or_create_collection(
+                COLLECTION_NAME,
+                metadata=HNSW_METADATA
+            )
+            self.embedder = get_embedder(EMBEDDING_MODEL)
             logger.info("Векторная БД инициализирована")
         except Exception as e:
             logger.error(f"Ошибка инициализации векторной БД: {e}")
             raise
 
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Выполнение синхронного вызова в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(func, *args, **kwargs))
+
+    def _stream_generation(self, model: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                           system: Optional[str] = None, profile: bool = False,
+                           **final_fields) -> StreamingResponse:
+        """Потоковая генерация: токены отдаются клиенту как server-sent events"""
+        async def events():
+            start_ns = time.perf_counter_ns()
+            try:
+                stream = await self.ollama_async_client.generate(
+                    model=model,
+                    prompt=prompt,
+                    system=system,
+                    options=options or {},
+                    stream=True,
+                    keep_alive=OLLAMA_KEEP_ALIVE
+                )
+                async for chunk in stream:
+                    if chunk['response']:
+                        yield f"data: {json.dumps({'response': chunk['response']}, ensure_ascii=False)}\n\n"
+                
+                generation_time = _elapsed(start_ns)
+                logger.info(f"Потоковая генерация завершена за {generation_time:.3f} сек")
+                final = {"done": True, "model": model, **final_fields}
+                if profile:
+                    final["generation_time"] = generation_time
+            except Exception as e:
+                logger.error(f"Ошибка потоковой генерации: {e}")
+                final = {"done": True, "error": str(e)}
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @staticmethod
+    def _rag_prompt(query: str, documents: List[str]) -> str:
+        """Промпт RAG из найденных документов"""
+        context = _fit_context(documents) if documents else "Информация не найдена в базе знаний."
+        return RAG_PROMPT_TEMPLATE.format(context=context, query=query)
+
+    async def _embed_documents(self, doc_ids: List[str], texts: List[str]) -> np.ndarray:
+        """Эмбеддинги документов: из кэша по ID, промахи считаются одним вызовом encode"""
+        embeddings = [self._document_embedding_cache.get(doc_id) for doc_id in doc_ids]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if misses:
+            computed = await self._run_blocking(
+                self.embedder.encode, [texts[i] for i in misses], convert_to_numpy=True
+            )
+            for i, embedding in zip(misses, computed):
+                embeddings[i] = embedding
+                self._document_embedding_cache.put(doc_ids[i], embedding)
+        
+        return np.vstack(embeddings)
+
+    async def _add_batch(self, documents: List[DocumentAddRequest]) -> int:
+        """Запись пакета документов, возвращает число добавленных"""
+        # Повторы внутри пакета и уже сохраненные документы не эмбеддим заново
+        unique_docs = {}
+        for doc in documents:
+            unique_docs.setdefault(_doc_id(doc.text), doc)
+        
+        existing_ids = set()
+        if unique_docs:
+            existing = await self._run_blocking(self.collection.get, ids=list(unique_docs), include=[])
+            existing_ids = set(existing["ids"])
+        doc_ids = [doc_id for doc_id in unique_docs if doc_id not in existing_ids]
+        
+        if doc_ids:
+            texts = [unique_docs[doc_id].text for doc_id in doc_ids]
+            metadatas = [unique_docs[doc_id].metadata or {"source": "batch_mcp", "type": "fact"} for doc_id in doc_ids]
+            
+            embeddings = await self._embed_documents(doc_ids, texts)
+            
+            await self._run_blocking(
+                self.collection.add,
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=metadatas,
+                ids=doc_ids
+            )
+            self._clear_answer_caches()
+        
+        return len(doc_ids)
+
+    def _clear_answer_caches(self):
+        """Сброс кэшей ответов /rag: они зависят от содержимого БД"""
+        self._rag_cache.clear()
+        self._semantic_cache.clear()
+
+    async def _embed_query(self, text: str):
+        """Эмбеддинг одного запроса через общий пакет с параллельными запросами"""
+        # Запросы, отличающиеся только пробелами, эмбеддятся и кэшируются как один
+        text = " ".join(text.split())
+        cached = self._query_embedding_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        if self._embed_task is None:
+            self._embed_queue = asyncio.Queue()
+            self._embed_task = asyncio.create_task(self._embed_loop())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._embed_queue.put((text, future))
+        embedding = await future
+        self._query_embedding_cache.put(text, embedding)
+        return embedding
+
+    async def _embed_loop(self):
+        """Сборка запросов в пакеты и один вызов encode на пакет"""
+        while True:
+            items = [await self._embed_queue.get()]
+            await asyncio.sleep(EMBED_BATCH_WINDOW)
+            while not self._embed_queue.empty() and len(items) < EMBED_BATCH_MAX_SIZE:
+                items.append(self._embed_queue.get_nowait())
+            
+            try:
+                embeddings = await self._run_blocking(
+                    self.embedder.encode, [text for text, _ in items], convert_to_numpy=True
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(items, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    async def _search_documents(self, embedding, top_k: int) -> List[str]:
+        """Поиск документов для /rag через общий пакетный запрос к коллекции"""
+        if self._search_task is None:
+            self._search_queue = asyncio.Queue()
+            self._search_task = asyncio.create_task(self._search_loop())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._search_queue.put((embedding, top_k, future))
+        return await future
+
+    async def _search_loop(self):
+        """Один collection.query на пакет одновременных поисков /rag"""
+        while True:
+            items = [await self._search_queue.get()]
+            await asyncio.sleep(EMBED_BATCH_WINDOW)
+            while not self._search_queue.empty() and len(items) < EMBED_BATCH_MAX_SIZE:
+                items.append(self._search_queue.get_nowait())
+            
+            # Результаты упорядочены по близости: запросы с меньшим top_k берут префикс
+            try:
+                results = await self._run_blocking(
+                    self.collection.query,
+                    query_embeddings=np.vstack([embedding for embedding, _, _ in items]),
+                    n_results=max(top_k for _, top_k, _ in items),
+                    include=["documents", "embeddings"]
+                )
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            documents = results["documents"] or [[] for _ in items]
+            embeddings = results["embeddings"] if results.get("embeddings") is not None else [[] for _ in items]
+            for (_, top_k, future), found, found_embeddings in zip(items, documents, embeddings):
+                if not future.done():
+                    future.set_result(_distinct_documents(found[:top_k], found_embeddings[:top_k]))
+
+    async def _retrieve(self, query: str, embedding, top_k: int) -> List[str]:
+        """Документы для RAG-промпта: поиск и, если задана модель, переранжирование кандидатов"""
+        if not RERANK_MODEL:
+            return await self._search_documents(embedding, top_k)
+        
+        candidates = await self._search_documents(embedding, max(top_k, RERANK_CANDIDATES))
+        if len(candidates) <= 1:
+            return candidates
+        scores = await self._run_blocking(
+            get_reranker().predict, [(query, document) for document in candidates], show_progress_bar=False
+        )
+        ranked = sorted(zip(scores, candidates), key=lambda pair: pair[0], reverse=True)
+        return [document for _, document in ranked[:top_k]]
+
     def _init_llm_client(self):
         """Инициализация клиента для работы с LLM моделями"""
         try:
-            self.ollama_client = OllamaClient(host='http://ai-dev.hpclab:11434')
+            ollama_host = 'http://ai-dev.hpclab:11434'
+            self.ollama_client = OllamaClient(host=ollama_host, timeout=OLLAMA_TIMEOUT)
+            self.ollama_async_client = OllamaAsyncClient(
+                host=ollama_host,
+                timeout=OLLAMA_TIMEOUT,
+                limits=OLLAMA_LIMITS
+            )
             
             models_response = self.ollama_client.list()
             
             if 'models' in models_response:
-                models_list = models_response['models']
-                self.available_models = []
-                for model in models_list:
-                    if 'name' in model:
-                        self.available_models.append(model['name'])
-                    elif 'model' in model:
-                        self.available_models.append(model['model'])
-                
+                self.available_models = _model_names(models_response)
                 logger.info(f"LLM клиент инициализирован. Доступно моделей: {len(self.available_models)}")
             else:
                 logger.warning("Неожиданный формат ответа от Ollama")
-                self.available_models = []
+                self.available_models = frozenset()
                 
         except Exception as e:
             logger.error(f"Ошибка инициализации LLM клиента: {e}")
             logger.warning("Продолжаем инициализацию сервера без LLM моделей")
-            self.available_models = []
+            self.available_models = frozenset()
+
+    async def _refresh_models(self):
+        """Периодическое обновление списка доступных моделей"""
+        while True:
+            await asyncio.sleep(MODELS_REFRESH_INTERVAL)
+            try:
+                models_response = await self.ollama_async_client.list()
+                if 'models' in models_response:
+                    # Замена одним присваиванием: читатели видят старый или новый набор целиком
+                    self.available_models = _model_names(models_response)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить список моделей: {e}")
+
+    def _health_status(self) -> Dict[str, Any]:
+        """Состояние векторной БД и LLM клиента"""
+        db_status = "healthy" if hasattr(self, 'collection') else "unhealthy"
+        llm_status = "healthy" if hasattr(self, 'ollama_client') and self.available_models else "unhealthy"
+        
+        return {
+            "status": "healthy",
+            "services": {
+                "vector_db": db_status,
+                "llm_models": llm_status
+            },
+            "models_available": len(self.available_models)
+        }
+
+    async def _warmup_llm(self):
+        """Загрузка модели и предзаполнение KV-кэша общего системного промпта до первого запроса"""
+        if not OLLAMA_WARMUP_MODEL or OLLAMA_WARMUP_MODEL not in self.available_models:
+            return
+        try:
+            await self.ollama_async_client.generate(
+                model=OLLAMA_WARMUP_MODEL,
+                prompt=RAG_PROMPT_TEMPLATE.format(context="", query=""),
+                system=RAG_SYSTEM_PROMPT,
+                options={**RAG_OPTIONS, "num_predict": 1},
+                keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            logger.info(f"Модель {OLLAMA_WARMUP_MODEL} прогрета")
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть модель {OLLAMA_WARMUP_MODEL}: {e}")
+
+    def _warmup_vector_db(self):
+        """Загрузка HNSW-индекса коллекции в память до первого запроса"""
+        if self.collection.count() == 0:
+            return
+        embedding = self.embedder.encode(["warmup"], convert_to_numpy=True)
+        self.collection.query(query_embeddings=embedding, n_results=1, include=[])
             
     def setup_routes(self):
         """Регистрация всех API эндпоинтов"""
         
+        @self.app.on_event("startup")
+        async def start_background_tasks():
+            if hasattr(self, 'ollama_async_client'):
+                self._models_task = asyncio.create_task(self._refresh_models())
+                # Прогрев в фоне: сервер начинает принимать запросы, не дожидаясь загрузки модели
+                self._llm_warmup_task = asyncio.create_task(self._warmup_llm())
+        
+        @self.app.on_event("startup")
+        async def warmup_vector_db():
+            try:
+                await self._run_blocking(self._warmup_vector_db)
+            except Exception as e:
+                logger.warning(f"Не удалось прогреть векторную БД: {e}")
+        
         @self.app.get("/")
         async def root():
             return {
@@ -115,53 +770,63 @@ class AIMCPServer:
 
         @self.app.get("/health")
         async def health_check():
-            db_status = "healthy" if hasattr(self, 'collection') else "unhealthy"
-            llm_status = "healthy" if hasattr(self, 'ollama_client') and self.available_models else "unhealthy"
-            
-            return {
-                "status": "healthy",
-                "services": {
-                    "vector_db": db_status,
-                    "llm_models": llm_status
-                },
-                "models_available": len(self.available_models)
-            }
+            return self._health_status()
+
+        @self.app.get("/status")
+        async def full_status():
+            """Состояние сервисов, список моделей и информация о коллекции одним запросом"""
+            try:
+                count = await self._run_blocking(self.collection.count)
+                return {
+                    **self._health_status(),
+                    # Набор моделей обновляется фоновой задачей, Ollama здесь не опрашивается
+                    "models": sorted(self.available_models),
+                    "collection": {
+                        "document_count": count,
+                        "collection_name": COLLECTION_NAME,
+                        "status": "active"
+                    }
+                }
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Status error: {str(e)}")
 
         # ==================== ВЕКТОРНАЯ БД ЭНДПОИНТЫ ====================
         
         @self.app.post("/search")
         async def search_documents(request: SearchRequest):
             """Поиск документов по семантическому сходству"""
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             try:
-                logger.info(f"Поиск документов: {request.query}")
+                logger.debug(f"Поиск документов: {request.query}")
                 
-                vector_start = time.time()
-                query_embedding = self.embedder.encode([request.query]).tolist()
-                vector_time = time.time() - vector_start
+                query_embedding = (await self._embed_query(request.query)).reshape(1, -1)
+                vector_ns = time.perf_counter_ns()
                 
-                search_start = time.time()
-                results = self.collection.query(
+                results = await self._run_blocking(
+                    self.collection.query,
                     query_embeddings=query_embedding,
-                    n_results=request.top_k
+                    n_results=request.top_k,
+                    include=["documents"]
                 )
-                search_time = time.time() - search_start
+                end_ns = time.perf_counter_ns()
                 
                 documents = results["documents"][0] if results["documents"] else []
-                total_time = time.time() - start_time
+                total_time = (end_ns - start_ns) / 1e9
                 
                 logger.info(f"Найдено {len(documents)} документов за {total_time:.3f} сек")
                 
-                return {
+                result = {
                     "documents": documents,
                     "count": len(documents),
-                    "query": request.query,
-                    "timing": {
-                        "total": round(total_time, 3),
-                        "vectorization": round(vector_time, 3),
-                        "search": round(search_time, 3)
-                    }
+                    "query": request.query
                 }
+                if _timing_enabled(request):
+                    result["timing"] = {
+                        "total": total_time,
+                        "vectorization": (vector_ns - start_ns) / 1e9,
+                        "search": (end_ns - vector_ns) / 1e9
+                    }
+                return result
                 
             except Exception as e:
                 logger.error(f"Ошибка поиска: {e}")
@@ -171,20 +836,31 @@ class AIMCPServer:
         async def add_document(request: DocumentAddRequest):
             """Добавление документа в векторную БД"""
             try:
-                logger.info(f"Добавление документа: {request.text[:50]}...")
+                logger.debug(f"Добавление документа: {request.text[:50]}...")
                 
-                if request.metadata is None:
-                    request.metadata = {"source": "mcp_api", "type": "fact"}
+                metadata = request.metadata or {"source": "mcp_api", "type": "fact"}
+                
+                doc_id = _doc_id(request.text)
+                existing = await self._run_blocking(self.collection.get, ids=[doc_id], include=[])
+                if existing["ids"]:
+                    logger.debug(f"Документ уже есть в БД, ID: {doc_id}")
+                    return {
+                        "success": True,
+                        "message": "Документ уже существует",
+                        "doc_id": doc_id,
+                        "text_length": len(request.text)
+                    }
                 
-                embedding = self.embedder.encode([request.text]).tolist()
-                doc_id = f"doc_{hash(request.text) % 1000000}"
+                embedding = await self._embed_documents([doc_id], [request.text])
                 
-                self.collection.add(
+                await self._run_blocking(
+                    self.collection.add,
                     embeddings=embedding,
                     documents=[request.text],
-                    metadatas=[request.metadata],
+                    metadatas=[metadata],
                     ids=[doc_id]
                 )
+                self._clear_answer_caches()
                 
                 logger.info(f"Документ добавлен с ID: {doc_id}")
                 
@@ -199,14 +875,22 @@ class AIMCPServer:
                 logger.error(f"Ошибка добавления: {e}")
                 raise HTTPException(status_code=500, detail=f"Add error: {str(e)}")
 
+        @self.app.post("/cache/clear")
+        async def clear_caches():
+            """Сброс кэшей эмбеддингов и ответов RAG"""
+            self._query_embedding_cache.clear()
+            self._document_embedding_cache.clear()
+            self._clear_answer_caches()
+            return {"success": True, "message": "Кэши очищены"}
+
         @self.app.get("/info")
         async def get_collection_info():
             """Получение информации о коллекции"""
             try:
-                count = self.collection.count()
+                count = await self._run_blocking(self.collection.count)
                 return {
                     "document_count": count,
-                    "collection_name": "rag_memory",
+                    "collection_name": COLLECTION_NAME,
                     "status": "active"
                 }
             except Exception as e:
@@ -217,28 +901,40 @@ class AIMCPServer:
         @self.app.post("/generate")
         async def generate_text(request: GenerateRequest):
             """Генерация текста через LLM модель"""
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             try:
-                logger.info(f"Генерация текста моделью: {request.model}")
+                logger.debug(f"Генерация текста моделью: {request.model}")
                 
                 if request.model not in self.available_models:
                     raise HTTPException(status_code=400, detail=f"Модель {request.model} не доступна")
                 
-                response = self.ollama_client.generate(
+                if request.stream:
+                    return self._stream_generation(
+                        request.model,
+                        request.prompt,
+                        request.options,
+                        profile=_timing_enabled(request),
+                        prompt_length=len(request.prompt)
+                    )
+                
+                response = await self.ollama_async_client.generate(
                     model=request.model,
                     prompt=request.prompt,
-                    options=request.options or {}
+                    options=request.options or {},
+                    keep_alive=OLLAMA_KEEP_ALIVE
                 )
                 
-                generation_time = time.time() - start_time
+                generation_time = _elapsed(start_ns)
                 logger.info(f"Текст сгенерирован за {generation_time:.3f} сек")
                 
-                return {
+                result = {
                     "response": response['response'],
                     "model": request.model,
-                    "prompt_length": len(request.prompt),
-                    "generation_time": round(generation_time, 3)
+                    "prompt_length": len(request.prompt)
                 }
+                if _timing_enabled(request):
+                    result["generation_time"] = generation_time
+                return result
                 
             except Exception as e:
                 logger.error(f"Ошибка генерации: {e}")
@@ -248,9 +944,10 @@ class AIMCPServer:
         async def list_models():
             """Получение списка доступных моделей"""
             try:
-                models_response = self.ollama_client.list()
+                models_response = await self.ollama_async_client.list()
                 
                 if 'models' in models_response:
+                    self.available_models = _model_names(models_response)
                     models_list = models_response['models']
                     formatted_models = []
                     for model in models_list:
@@ -285,96 +982,208 @@ class AIMCPServer:
         @self.app.post("/rag")
         async def rag_query(request: RAGRequest):
             """Полный RAG pipeline: поиск + генерация"""
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             try:
-                logger.info(f"RAG запрос: {request.query}")
+                logger.debug(f"RAG запрос: {request.query}")
                 
-                search_start = time.time()
-                query_embedding = self.embedder.encode([request.query]).tolist()
-                results = self.collection.query(
-                    query_embeddings=query_embedding,
-                    n_results=request.top_k
-                )
-                search_time = time.time() - search_start
+                cache_key = (request.query.strip().lower(), request.model, request.top_k)
+                if not request.stream:
+                    cached = self._rag_cache.get(cache_key)
+                    if cached is not None:
+                        logger.debug("RAG ответ взят из кэша")
+                        return {**cached, "cached": True}
                 
-                documents = results["documents"][0] if results["documents"] else []
+                search_start_ns = time.perf_counter_ns()
+                query_embedding = (await self._embed_query(request.query)).reshape(1, -1)
+                semantic_key = (request.model, request.top_k)
+                if not request.stream:
+                    cached = self._semantic_cache.get(query_embedding, semantic_key)
+                    if cached is not None:
+                        logger.debug("RAG ответ взят из семантического кэша")
+                        self._rag_cache.put(cache_key, cached)
+                        return {**cached, "cached": True}
                 
-                context = "\n".join(documents) if documents else "Информация не найдена в базе знаний."
+                documents = await self._retrieve(request.query, query_embedding, request.top_k)
+                search_end_ns = time.perf_counter_ns()
+                search_time = (search_end_ns - search_start_ns) / 1e9
                 
-                prompt = f"""Ты - полезный AI-ассистент с доступом к базе знаний. 
-Твоя задача - отвечать на вопросы пользователя, используя предоставленный контекст.
-
-ИНСТРУКЦИИ:
-1. Отвечай ТОЛЬКО на русском языке
-2. Используй информацию из контекста, если она есть
-3. Если информации в контексте НЕТ, скажи "Информация по данному вопросу отсутствует в базе знаний"
-4. Не добавляй информацию, которой нет в контексте
-
-КОНТЕКСТ:
-{context}
-
-ВОПРОС: {request.query}
-
-ОТВЕТ:"""
+                prompt = self._rag_prompt(request.query, documents)
+                
+                if request.stream:
+                    return self._stream_generation(
+                        request.model,
+                        prompt,
+                        options=RAG_OPTIONS,
+                        system=RAG_SYSTEM_PROMPT,
+                        profile=_timing_enabled(request),
+                        documents_found=len(documents),
+                        query=request.query
+                    )
                 
-                gen_start = time.time()
-                response = self.ollama_client.generate(
+                response = await self.ollama_async_client.generate(
                     model=request.model,
-                    prompt=prompt
+                    prompt=prompt,
+                    system=RAG_SYSTEM_PROMPT,
+                    options=RAG_OPTIONS,
+                    keep_alive=OLLAMA_KEEP_ALIVE
                 )
-                gen_time = time.time() - gen_start
-                
-                total_time = time.time() - start_time
+                end_ns = time.perf_counter_ns()
+                total_time = (end_ns - start_ns) / 1e9
                 
                 logger.info(f"RAG ответ сгенерирован за {total_time:.3f} сек")
                 
-                return {
+                result = {
                     "answer": response['response'],
                     "documents_found": len(documents),
                     "model": request.model,
-                    "query": request.query,
-                    "timing": {
-                        "total": round(total_time, 3),
-                        "search": round(search_time, 3),
-                        "generation": round(gen_time, 3)
-                    }
+                    "query": request.query
                 }
+                if _timing_enabled(request):
+                    result["timing"] = {
+                        "total": total_time,
+                        "search": search_time,
+                        "generation": (end_ns - search_end_ns) / 1e9
+                    }
+                self._rag_cache.put(cache_key, result)
+                self._semantic_cache.put(query_embedding, semantic_key, result)
+                return result
                 
             except Exception as e:
                 logger.error(f"Ошибка RAG: {e}")
                 raise HTTPException(status_code=500, detail=f"RAG error: {str(e)}")
 
+        @self.app.post("/rag_batch")
+        async def rag_batch(request: RAGBatchRequest):
+            """RAG pipeline для пакета запросов: один поиск по всем запросам и параллельная генерация"""
+            start_ns = time.perf_counter_ns()
+            try:
+                cache_keys = [(query.strip().lower(), request.model, request.top_k) for query in request.queries]
+                answers = [self._rag_cache.get(key) for key in cache_keys]
+                answers = [{**answer, "cached": True} if answer is not None else None for answer in answers]
+                pending = [i for i, answer in enumerate(answers) if answer is None]
+                
+                search_time = 0.0
+                if pending:
+                    search_start_ns = time.perf_counter_ns()
+                    # Параллельные _embed_query попадают в один пакет encode
+                    embeddings = await asyncio.gather(
+                        *(self._embed_query(request.queries[i]) for i in pending)
+                    )
+                    # Поиски пакета сливаются в один collection.query в _search_loop
+                    found = await asyncio.gather(*(
+                        self._retrieve(request.queries[i], embedding.reshape(1, -1), request.top_k)
+                        for i, embedding in zip(pending, embeddings)
+                    ))
+                    search_time = _elapsed(search_start_ns)
+                    
+                    async def answer_query(query: str, documents: List[str]) -> Dict[str, Any]:
+                        response = await self.ollama_async_client.generate(
+                            model=request.model,
+                            prompt=self._rag_prompt(query, documents),
+                            system=RAG_SYSTEM_PROMPT,
+                            options=RAG_OPTIONS,
+                            keep_alive=OLLAMA_KEEP_ALIVE
+                        )
+                        return {
+                            "answer": response['response'],
+                            "documents_found": len(documents),
+                            "model": request.model,
+                            "query": query
+                        }
+                    
+                    generated = await asyncio.gather(
+                        *(answer_query(request.queries[i], documents) for i, documents in zip(pending, found))
+                    )
+                    for i, answer in zip(pending, generated):
+                        answers[i] = answer
+                        self._rag_cache.put(cache_keys[i], answer)
+                
+                total_time = _elapsed(start_ns)
+                logger.info(f"RAG пакет из {len(answers)} запросов обработан за {total_time:.3f} сек")
+                
+                result = {"results": answers, "model": request.model}
+                if _timing_enabled(request):
+                    result["timing"] = {
+                        "total": total_time,
+                        "search": search_time,
+                        "generation": total_time - search_time
+                    }
+                return result
+                
+            except Exception as e:
+                logger.error(f"Ошибка RAG пакета: {e}")
+                raise HTTPException(status_code=500, detail=f"RAG batch error: {str(e)}")
+
         @self.app.post("/batch_add")
         async def batch_add_documents(documents: List[DocumentAddRequest]):
             """Пакетное добавление документов"""
             try:
-                texts = [doc.text for doc in documents]
-                metadatas = [doc.metadata or {"source": "batch_mcp", "type": "fact"} for doc in documents]
+                # Окнами: матрица эмбеддингов и запись в ChromaDB ограничены STREAM_BATCH_SIZE
+                added = 0
+                for start in range(0, len(documents), STREAM_BATCH_SIZE):
+                    added += await self._add_batch(documents[start:start + STREAM_BATCH_SIZE])
                 
-                embeddings = self.embedder.encode(texts).tolist()
-                doc_ids = [f"batch_{hash(text) % 1000000}" for text in texts]
+                return {
+                    "success": True,
+                    "message": f"Добавлено {added} документов",
+                    "count": added,
+                    "skipped": len(documents) - added
+                }
                 
-                self.collection.add(
-                    embeddings=embeddings,
-                    documents=texts,
-                    metadatas=metadatas,
-                    ids=doc_ids
-                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Batch add error: {str(e)}")
+
+        @self.app.post("/batch_add_stream")
+        async def batch_add_stream(request: Request):
+            """Потоковое пакетное добавление из NDJSON (один документ на строку)"""
+            # Документы пишутся окнами по мере чтения тела: при ошибке в строке
+            # уже записанные окна остаются в БД
+            received = 0
+            added = 0
+            window = []
+            buffer = b""
+            try:
+                async def flush():
+                    nonlocal received, added, window
+                    received += len(window)
+                    added += await self._add_batch(window)
+                    window = []
+                
+                async for chunk in request.stream():
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        if line.strip():
+                            window.append(DocumentAddRequest.model_validate_json(line))
+                            if len(window) >= STREAM_BATCH_SIZE:
+                                await flush()
+                
+                if buffer.strip():
+                    window.append(DocumentAddRequest.model_validate_json(buffer))
+                if window:
+                    await flush()
                 
                 return {
                     "success": True,
-                    "message": f"Добавлено {len(documents)} документов",
-                    "count": len(documents)
+                    "message": f"Добавлено {added} документов",
+                    "count": added,
+                    "skipped": received - added
                 }
                 
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Invalid document after {received + len(window)} lines (added {added}): {e}"
+                )
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Batch add error: {str(e)}")
+
         @self.app.post("/clear")
         async def clear_collection():
             """Очистка коллекции (удаление всех документов)"""
             try:
                 # Получаем текущее количество документов
-                count = self.collection.count()
+                count = await self._run_blocking(self.collection.count)
                 
                 if count == 0:
                     return {
@@ -384,12 +1193,13 @@ class AIMCPServer:
                     }
                 
                 # Получаем все ID документов
-                all_docs = self.collection.get()
+                all_docs = await self._run_blocking(self.collection.get, include=[])
                 doc_ids = all_docs.get('ids', [])
                 
                 if doc_ids:
                     # Удаляем все документы по ID
-                    self.collection.delete(ids=doc_ids)
+                    await self._run_blocking(self.collection.delete, ids=doc_ids)
+                    self._clear_answer_caches()
                     
                 logger.info(f"Коллекция очищена. Удалено документов: {count}")
                 
@@ -402,11 +1212,22 @@ class AIMCPServer:
                 logger.error(f"Ошибка очистки коллекции: {e}")
                 raise HTTPException(status_code=500, detail=f"Clear error: {str(e)}")
 
+
+def create_app() -> FastAPI:
+    """Фабрика приложения для запуска под gunicorn (см. gunicorn.conf.py)"""
+    return AIMCPServer().app
+
+
 def main():
     """Запуск MCP сервера"""
     try:
         server = AIMCPServer()
         
+        if MCP_UDS:
+            print(f"Запуск AI MCP Server на unix-сокете {MCP_UDS}")
+            uvicorn.run(server.app, uds=MCP_UDS, log_level="info")
+            return
+        
         print("Запуск AI MCP Server на http://localhost:8000")
         print("Сервисы:")
         print("  - Векторная БД (ChromaDB)")
@@ -431,5 +1252,6 @@ def main():
         print("  - Запущен ли Ollama")
         print("  - Доступен ли порт 8000")
 
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
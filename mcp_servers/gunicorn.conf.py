@@ -0,0 +1,34 @@
+"""
+Конфигурация gunicorn для запуска AI MCP сервера в несколько процессов:
+
+    gunicorn -c mcp_servers/gunicorn.conf.py
+
+Приложение (preload_app выключен) и вместе с ним модель эмбеддингов, ChromaDB
+и клиенты Ollama создаются в каждом воркере после fork(): пулы потоков
+ONNX Runtime/OpenMP и SQLite-соединения нельзя переносить через fork().
+Каждый воркер держит свою копию весов модели: память модели не разделяется
+и растет пропорционально числу воркеров.
+"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# MCP_UDS: unix-сокет для клиентов на той же машине вместо TCP
+bind = f"unix:{os.environ['MCP_UDS']}" if os.getenv("MCP_UDS") else "0.0.0.0:8000"
+workers = (os.cpu_count() or 2) // 2 or 1
+worker_class = "uvicorn.workers.UvicornWorker"
+wsgi_app = "ai_mcp_server:create_app()"
+preload_app = False
+# Загрузка модели может занимать десятки секунд
+timeout = 120
+
+# Ядра делятся между воркерами: каждый запускает эмбеддер в cpu_count // workers потоков
+os.environ["MCP_WORKERS"] = str(workers)
+
+# Кэши ответов /rag не сбрасываются в соседних воркерах при записи в БД
+if workers > 1:
+    os.environ.setdefault("RAG_CACHE_SIZE", "0")
+    os.environ.setdefault("SEMANTIC_CACHE_SIZE", "0")
+
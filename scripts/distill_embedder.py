@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Скрипт для статической дистилляции модели эмбеддингов (model2vec)
+"""
+import os
+import sys
+from pathlib import Path
+
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+PCA_DIMS = 256
+
+def distill_embedder():
+    """Дистилляция модели эмбеддингов в статическую таблицу токенов"""
+    output_path = Path(os.getenv(
+        "EMBEDDING_STATIC_MODEL",
+        Path(__file__).parent.parent / "data" / "m2v-mini"
+    ))
+    
+    try:
+        from model2vec.distill import distill
+    except ImportError:
+        print("❌ Не установлен model2vec: pip install 'model2vec[distill]'")
+        return False
+    
+    print(f"🔄 Дистилляция {EMBEDDING_MODEL} ({PCA_DIMS} измерений)...")
+    try:
+        model = distill(model_name=EMBEDDING_MODEL, pca_dims=PCA_DIMS)
+        model.save_pretrained(str(output_path))
+    except Exception as e:
+        print(f"❌ Ошибка дистилляции: {e}")
+        return False
+    
+    print(f"✅ Статическая модель сохранена: {output_path}")
+    print("⚡ Запуск сервера с ней: EMBEDDING_BACKEND=model2vec python scripts/start_mcp_server.py")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if distill_embedder() else 1)
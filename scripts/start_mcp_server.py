@@ -4,7 +4,6 @@
 """
 import subprocess
 import sys
-import os
 from pathlib import Path
 
 def start_ai_mcp_server():
@@ -28,6 +27,7 @@ def start_ai_mcp_server():
     print("⚡ Для остановки сервера нажмите Ctrl+C")
     print("-" * 50)
     
+    # Потоки эмбеддера задает сам сервер (_configure_threads в ai_mcp_server.py)
     try:
         subprocess.run([
             sys.executable, str(server_path)
@@ -17,6 +17,9 @@ CHROMA_COLLECTION_NAME = "diplom_rag_memory"
 # Настройки поиска
 TOP_K_RESULTS = 3
 
+# Режим доступа к БД и LLM: http - через MCP сервер, local - прямые вызовы в процессе
+MCP_MODE = os.getenv("MCP_MODE", "http")
+
 # Создаем необходимые директории
 VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
 (DATA_DIR / "test_documents").mkdir(parents=True, exist_ok=True)
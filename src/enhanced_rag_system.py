@@ -1,11 +1,15 @@
+import atexit
 import logging
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import json
 
 from config import *
-from mcp_client import MCPClient
+from mcp_client import get_mcp_client
+from memory_filter import NearDuplicateFilter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,29 +17,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Реплик (пар вопрос-ответ) истории диалога в памяти: старые вытесняются
+DIALOG_HISTORY_SIZE = 200
+
+# Фразы, при которых ответ не сохраняется в память, и приветствия в запросе:
+# одна скомпилированная альтернатива без учета регистра, без копии строки в lower()
+FORBIDDEN_PHRASES_RE = re.compile("|".join(map(re.escape, [
+    "не знаю", "неизвестно", "не нашел информации",
+    "отсутствует в базе знаний", "не удалось получить ответ"
+])), re.IGNORECASE)
+GREETINGS_RE = re.compile("|".join(map(re.escape, ["привет", "здравствуй", "hello", "пока"])), re.IGNORECASE)
+
+# Запрос из одного приветствия отвечается сразу, без эмбеддинга, поиска и генерации
+GREETING_ONLY_RE = re.compile(r"(привет|здравствуй(те)?|добрый день|hello|hi)[\s!.,]*", re.IGNORECASE)
+GREETING_ANSWER = "Здравствуйте! Задайте вопрос, и я поищу ответ в базе знаний."
+
+# Теги протокола ответа модели компилируются один раз при импорте, а не на каждый раунд
+NEED_CONTEXT_RE = re.compile(r'<NEED_CONTEXT>(.*?)(?:</NEED_CONTEXT>|$)', re.DOTALL)
+ANSWER_RE = re.compile(r'<ANSWER>(.*?)(?:</ANSWER>|$)', re.DOTALL)
+TAG_RE = re.compile(r'<[^>]+>')
+# Закрывающий тег завершает ответ модели: дальше генерировать нечего
+# (парсеры выше принимают ответ и без закрывающего тега)
+TAG_STOP_OPTIONS = {"stop": ["</ANSWER>", "</NEED_CONTEXT>"]}
+UNFINISHED_ANSWER_RE = re.compile(r'<need_context|запросил контекст', re.IGNORECASE)
+
 class EnhancedRAGSystem:
-    def __init__(self, model_name=MODEL_NAME, use_mcp=True, max_context_rounds=3):
+    def __init__(self, model_name=MODEL_NAME, use_mcp=MCP_MODE != "local", max_context_rounds=3):
         self.model_name = model_name
-        self.dialog_history = []
+        self.dialog_history = deque(maxlen=DIALOG_HISTORY_SIZE)
+        self._saved_dialogs = NearDuplicateFilter()
+        # Запись диалогов в память идет в фоне; один поток сохраняет порядок записей
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-writer")
+        # Если close() не вызван явно, фоновые записи завершаются при выходе
+        atexit.register(self.close)
         self.use_mcp = use_mcp
         self.max_context_rounds = max_context_rounds
         
         # Регулярные выражения для парсинга тегов
-        # В __init__ замените:
-        self.need_context_pattern = re.compile(r'<NEED_CONTEXT>(.*?)(?:</NEED_CONTEXT>|$)', re.DOTALL)
-        self.answer_pattern = re.compile(r'<ANSWER>(.*?)(?:</ANSWER>|$)', re.DOTALL)
+        self.need_context_pattern = NEED_CONTEXT_RE
+        self.answer_pattern = ANSWER_RE
         
         if self.use_mcp:
             try:
-                self.mcp_client = MCPClient()
-                if self.mcp_client.is_server_running():
-                    server_info = self.mcp_client.get_server_info()
-                    services = server_info.get("services", {})
+                # Отдельная проверка /health не нужна: /status одновременно проверяет доступность
+                self.mcp_client = get_mcp_client()
+                # Состояние сервисов и список моделей - одним запросом
+                status = self.mcp_client.get_full_status()
+                if status:
+                    services = status.get("services", {})
                     
                     logger.info("RAG система инициализирована с MCP клиентом")
                     logger.info(f"Статус сервисов: БД({services.get('vector_db', 'unknown')})")
                     
-                    available_models = self.mcp_client.list_models()
+                    available_models = status.get("models", [])
                     if available_models:
                         logger.info(f"Доступные модели: {', '.join(available_models)}")
                 else:
@@ -44,10 +78,12 @@ class EnhancedRAGSystem:
             except Exception as e:
                 logger.error(f"Ошибка инициализации MCP клиента: {e}")
                 self.use_mcp = False
-        else:
-            from vector_db import VectorStore
+        
+        # Без сервера (MCP_MODE=local или он недоступен) БД и LLM вызываются в процессе
+        if not self.use_mcp:
+            from vector_db import create_vector_store
             import ollama
-            self.vector_db = VectorStore()
+            self.vector_db = create_vector_store()
             self.ollama_client = ollama.Client()
             logger.info("RAG система с прямыми вызовами")
     
@@ -55,6 +91,9 @@ class EnhancedRAGSystem:
         """Очистка базы данных"""
         try:
             print("\nОчистка базы данных...")
+            # Отложенные записи не должны попасть в базу уже после очистки
+            self._writer.submit(lambda: None).result()
+            self._saved_dialogs.clear()
             
             if self.use_mcp:
                 # Получаем информацию до очистки
@@ -68,12 +107,10 @@ class EnhancedRAGSystem:
                 # Для очистки через MCP сервер используем прямой запрос
                 try:
                     # Отправляем POST запрос на эндпоинт /clear
-                    response = self.mcp_client.session.post(
-                        f"{self.mcp_client.server_url}/clear",
-                        timeout=30
-                    )
+                    response = self.mcp_client.session.post("/clear", timeout=30)
                     
                     if response.status_code == 200:
+                        self.mcp_client.reset_after_clear()
                         result = response.json()
                         deleted = result.get('deleted_count', 0)
                         print(f" База данных очищена. Удалено документов: {deleted}")
@@ -105,8 +142,8 @@ class EnhancedRAGSystem:
                 print(f"Папка {VECTOR_DB_DIR} удалена")
                 
                 # Создаём заново
-                from vector_db import VectorStore
-                self.vector_db = VectorStore()
+                from vector_db import create_vector_store
+                self.vector_db = create_vector_store()
                 
                 print(f" База данных очищена. Удалено документов: {before_count}")
             
@@ -132,23 +169,13 @@ class EnhancedRAGSystem:
         print("Загрузка начальной базы знаний...")
         
         success_count = 0
-        for knowledge in initial_knowledge:
-            if self.use_mcp:
-                success = self.mcp_client.add_document(
-                    knowledge, 
-                    {"source": "base_knowledge", "type": "fact"}
-                )
-                if success:
-                    success_count += 1
-                    print(f"Добавлено: {knowledge[:50]}...")
-                else:
-                    print(f"Ошибка добавления: {knowledge[:50]}...")
-            else:
-                self.vector_db.add_documents(
-                    [knowledge], 
-                    [{"source": "base_knowledge", "type": "fact"}]
-                )
-                success_count += 1
+        # Все факты эмбеддятся одним проходом модели и пишутся одним запросом
+        metadatas = [{"source": "base_knowledge", "type": "fact"} for _ in initial_knowledge]
+        if self.use_mcp:
+            success_count = self.mcp_client.add_documents_batch(initial_knowledge, metadatas)
+        else:
+            if self.vector_db.add_documents(initial_knowledge, metadatas):
+                success_count = len(initial_knowledge)
         
         print(f"Всего добавлено документов: {success_count}/{len(initial_knowledge)}")
         
@@ -232,7 +259,7 @@ class EnhancedRAGSystem:
             
             if documents:
                 context = "\n---\n".join(documents)
-                logger.info(f"Найден контекст ({len(documents)} документов)")
+                logger.debug(f"Найден контекст ({len(documents)} документов)")
                 return context
             else:
                 return "Информация по данному запросу отсутствует в базе знаний."
@@ -243,6 +270,10 @@ class EnhancedRAGSystem:
     def process_query(self, user_query: str) -> str:
         logger.info(f"Обработка запроса: {user_query}")
         
+        if GREETING_ONLY_RE.fullmatch(user_query.strip()):
+            self.dialog_history.append((user_query, GREETING_ANSWER))
+            return GREETING_ANSWER
+        
         current_prompt = self.build_initial_prompt(user_query)
         round_num = 0
         context_history = []
@@ -250,27 +281,29 @@ class EnhancedRAGSystem:
         
         while round_num < self.max_context_rounds:
             round_num += 1
-            logger.info(f"Раунд {round_num}/{self.max_context_rounds}")
+            logger.debug(f"Раунд {round_num}/{self.max_context_rounds}")
             
             # Получаем ответ от модели
             if self.use_mcp:
                 response = self.mcp_client.generate_text(
                     prompt=current_prompt,
-                    model=self.model_name
+                    model=self.model_name,
+                    options=TAG_STOP_OPTIONS
                 )
             else:
                 response = self.ollama_client.generate(
                     model=self.model_name,
-                    prompt=current_prompt
+                    prompt=current_prompt,
+                    options=TAG_STOP_OPTIONS
                 )['response']
             
-            logger.info(f"Сырой ответ модели (раунд {round_num}): {response[:200]}...")
+            logger.debug(f"Сырой ответ модели (раунд {round_num}): {response[:200]}...")
             
             # Проверяем запрос контекста
             need_context_match = self.need_context_pattern.search(response)
             if need_context_match:
                 context_request = need_context_match.group(1).strip()
-                logger.info(f"РАСПОЗНАН ЗАПРОС КОНТЕКСТА: {context_request[:100]}...")
+                logger.debug(f"РАСПОЗНАН ЗАПРОС КОНТЕКСТА: {context_request[:100]}...")
                 
                 # Проверка на пустой запрос
                 if not context_request or len(context_request) < 5:
@@ -326,23 +359,23 @@ class EnhancedRAGSystem:
             answer_match = self.answer_pattern.search(response)
             if answer_match:
                 final_answer = answer_match.group(1).strip()
-                logger.info(f"РАСПОЗНАН ОТВЕТ В ТЕГЕ на раунде {round_num}")
+                logger.debug(f"РАСПОЗНАН ОТВЕТ В ТЕГЕ на раунде {round_num}")
                 
-                self.dialog_history.extend([f"User: {user_query}", f"Assistant: {final_answer}"])
+                self.dialog_history.append((user_query, final_answer))
                 if self.should_save_to_memory(user_query, final_answer):
-                    self.save_to_memory(user_query, final_answer, context_history)
+                    self._writer.submit(self.save_to_memory, user_query, final_answer, context_history)
                 
                 return final_answer
             
             # Если ответ без тегов, но осмысленный
-            if len(response) > 20 and not any(phrase in response.lower() for phrase in ["<need_context", "запросил контекст"]):
-                logger.info(f"РАСПОЗНАН ОТВЕТ БЕЗ ТЕГОВ на раунде {round_num}")
+            if len(response) > 20 and not UNFINISHED_ANSWER_RE.search(response):
+                logger.debug(f"РАСПОЗНАН ОТВЕТ БЕЗ ТЕГОВ на раунде {round_num}")
                 
-                clean_response = re.sub(r'<[^>]+>', '', response).strip()
+                clean_response = TAG_RE.sub('', response).strip()
                 
-                self.dialog_history.extend([f"User: {user_query}", f"Assistant: {clean_response}"])
+                self.dialog_history.append((user_query, clean_response))
                 if self.should_save_to_memory(user_query, clean_response):
-                    self.save_to_memory(user_query, clean_response, context_history)
+                    self._writer.submit(self.save_to_memory, user_query, clean_response, context_history)
                 
                 return clean_response
             
@@ -355,66 +388,60 @@ class EnhancedRAGSystem:
     def save_to_memory(self, query: str, response: str, context_history: List[str]):
         """Сохранение информации в базу знаний"""
         try:
+            # Одна метка времени на весь диалог, с точностью до секунды
+            timestamp = datetime.now().isoformat(timespec="seconds")
+            
             if not self.use_mcp:
-                from vector_db import VectorStore
-                vector_db = VectorStore()
-                vector_db.add_documents(
+                saved = self.vector_db.add_documents(
                     [f"Вопрос: {query}", f"Ответ: {response}"],
                     [
-                        {"type": "dialog", "source": "user", "timestamp": datetime.now().isoformat()},
-                        {"type": "dialog", "source": "assistant", "timestamp": datetime.now().isoformat()}
+                        {"type": "dialog", "source": "user", "timestamp": timestamp},
+                        {"type": "dialog", "source": "assistant", "timestamp": timestamp}
                     ]
                 )
-                logger.info("Информация сохранена в память (прямой доступ)")
+                if saved:
+                    self._saved_dialogs.remember(f"{query}\n{response}")
+                    logger.info("Информация сохранена в память (прямой доступ)")
+                else:
+                    logger.warning("Диалог не сохранен в память")
                 return
             
-            # Сохраняем вопрос
-            self.mcp_client.add_document(
-                f"Вопрос: {query}",
-                {
-                    "type": "dialog",
-                    "timestamp": datetime.now().isoformat(),
-                    "source": "user"
-                }
-            )
-            
-            # Сохраняем ответ
-            self.mcp_client.add_document(
-                f"Ответ: {response}",
-                {
-                    "type": "dialog",
-                    "timestamp": datetime.now().isoformat(),
-                    "source": "assistant"
-                }
-            )
+            # Вопрос, ответ и использованный контекст уходят на сервер одним запросом
+            texts = [f"Вопрос: {query}", f"Ответ: {response}"]
+            metadatas = [
+                {"type": "dialog", "timestamp": timestamp, "source": "user"},
+                {"type": "dialog", "timestamp": timestamp, "source": "assistant"}
+            ]
             
-            # Сохраняем использованный контекст (только если он есть и не содержит ошибок)
+            # Контекст сохраняется только если он есть и не содержит ошибок
             if context_history and len(context_history) > 0:
                 last_context = context_history[-1]
                 if last_context and len(last_context) > 50 and "отсутствует" not in last_context.lower():
-                    self.mcp_client.add_document(
-                        f"Контекст для вопроса '{query[:50]}...': {last_context[:200]}",
-                        {
-                            "type": "context",
-                            "timestamp": datetime.now().isoformat(),
-                            "source": "retrieved"
-                        }
-                    )
-                    
+                    texts.append(f"Контекст для вопроса '{query[:50]}...': {last_context[:200]}")
+                    metadatas.append({"type": "context", "timestamp": timestamp, "source": "retrieved"})
+            
+            if self.mcp_client.add_documents_batch(texts, metadatas) < len(texts):
+                logger.warning("Диалог не сохранен в память")
+                return
+            
+            # Сигнатура запоминается только после записи: неудачная попытка не блокирует повтор
+            self._saved_dialogs.remember(f"{query}\n{response}")
             logger.info("Информация сохранена в память")
         except Exception as e:
             logger.error(f"Ошибка сохранения в память: {e}")
     
+    def close(self):
+        """Дожидается фоновых записей в память"""
+        self._writer.shutdown(wait=True)
+    
     def get_system_info(self) -> dict:
         """Получение информации о системе"""
         if self.use_mcp:
-            db_info = self.mcp_client.get_collection_info()
-            models = self.mcp_client.list_models()
-            doc_count = db_info.get("document_count", 0)
+            status = self.mcp_client.get_full_status()
+            models = status.get("models", [])
+            doc_count = status.get("collection", {}).get("document_count", 0)
         else:
-            from vector_db import VectorStore
-            vector_db = VectorStore()
-            doc_count = vector_db.get_collection_info().get("document_count", 0)
+            doc_count = self.vector_db.get_collection_info().get("document_count", 0)
             models = [self.model_name]
             
         return {
@@ -425,21 +452,20 @@ class EnhancedRAGSystem:
             "max_context_rounds": self.max_context_rounds,
             "using_mcp": self.use_mcp
         }
+    
     def should_save_to_memory(self, query: str, response: str) -> bool:
         """Определяет, стоит ли сохранять ответ в память"""
         if not response or len(response) < 10:
             return False
         
-        forbidden_phrases = [
-            "не знаю", "неизвестно", "не нашел информации", 
-            "отсутствует в базе знаний", "не удалось получить ответ"
-        ]
-        
-        response_lower = response.lower()
-        if any(phrase in response_lower for phrase in forbidden_phrases):
+        if FORBIDDEN_PHRASES_RE.search(response):
             return False
             
-        if any(word ыin query.lower() for word in ["привет", "здравствуй", "hello", "пока"]):
+        if GREETINGS_RE.search(query):
+            return False
+        
+        # Почти повтор уже сохраненной реплики не эмбеддится и не пишется заново
+        if self._saved_dialogs.seen(f"{query}\n{response}"):
             return False
             
         return True
\ No newline at end of file
@@ -1,6 +1,17 @@
 from enhanced_rag_system import EnhancedRAGSystem
 import sys
 
+EXIT_COMMANDS = frozenset(['quit', 'exit', 'выход', 'q'])
+
+def print_stats(rag):
+    """Вывод статистики системы"""
+    info = rag.get_system_info()
+    print(f"\nСтатистика:")
+    print(f"  Документов в БД: {info['documents_in_db']}")
+    print(f"  Модель: {info['model']}")
+    print(f"  Доступные модели: {', '.join(info['available_models'])}")
+    print(f"  История диалогов: {info['dialog_history_length']} реплик")
+
 def main():
     print("=" * 60)
     print("ДИПЛОМНЫЙ ПРОЕКТ: RAG-архитектура для долгосрочной памяти")
@@ -15,25 +26,24 @@ def main():
         print("Команды: 'quit' - выход, 'clear' - очистить базу данных, 'stats' - статистика")
         print("-" * 60)
         
+        # Служебные команды: одна проверка по словарю вместо цепочки сравнений
+        commands = {
+            'clear': rag.clear_database,
+            'stats': lambda: print_stats(rag)
+        }
+        
         while True:
             try:
                 user_input = input("\nВаш вопрос: ").strip()
                 
-                if user_input.lower() in ['quit', 'exit', 'выход', 'q']:
+                command = user_input.lower()
+                if command in EXIT_COMMANDS:
                     print("\nЗавершение работы")
                     break
                 
-                if user_input.lower() == 'clear':
-                    rag.clear_database()
-                    continue
-                    
-                if user_input.lower() == 'stats':
-                    info = rag.get_system_info()
-                    print(f"\nСтатистика:")
-                    print(f"  Документов в БД: {info['documents_in_db']}")
-                    print(f"  Модель: {info['model']}")
-                    print(f"  Доступные модели: {', '.join(info['available_models'])}")
-                    print(f"  История диалогов: {info['dialog_history_length']} записей")
+                handler = commands.get(command)
+                if handler is not None:
+                    handler()
                     continue
                 
                 if not user_input:
@@ -49,6 +59,9 @@ def main():
                 break
             except Exception as e:
                 print(f"\nОшибка: {e}")
+        
+        # Фоновые записи в память завершаются до выхода
+        rag.close()
                 
     except Exception as e:
         print(f"\nОшибка инициализации системы: {e}")
@@ -1,8 +1,13 @@
-import requests
-import json
-from typing import Dict, Any, List, Optional
+import gzip
+import httpx
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional
 import logging
-from time import sleep
+import os
+from time import monotonic, sleep
 
 logging.basicConfig(
     level=logging.INFO,
@@ -10,57 +15,133 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Параллельные запросы при откате с пакетных эндпоинтов на поштучные
+FALLBACK_WORKERS = 8
+# Размер клиентских кэшей результатов поиска и RAG-ответов
+CLIENT_CACHE_SIZE = 256
+# Unix-сокет сервера на той же машине: запросы идут мимо TCP-стека
+MCP_UDS = os.getenv("MCP_UDS")
+# Время жизни кэша ответа /health, сек
+HEALTH_TTL = 2.0
+# Тела запросов на запись крупнее порога отправляются сжатыми (gzip)
+COMPRESS_MIN_SIZE = 2048
+
+def _compressed_body(payload) -> Dict[str, Any]:
+    """Аргументы POST с JSON-телом, сжатым если оно крупнее COMPRESS_MIN_SIZE"""
+    body = orjson.dumps(payload)
+    if len(body) <= COMPRESS_MIN_SIZE:
+        return {"content": body}
+    return {
+        "content": gzip.compress(body, compresslevel=3),
+        "headers": {"Content-Encoding": "gzip"}
+    }
+
+class LRUCache:
+    """Простой LRU-кэш на OrderedDict"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+@lru_cache(maxsize=None)
+def _get_session(server_url: str, timeout: int) -> httpx.Client:
+    """Общий для всех клиентов процесса пул keep-alive соединений к серверу"""
+    # Транспорт сам повторяет неудачные подключения с экспоненциальной задержкой
+    return httpx.Client(
+        base_url=server_url,
+        timeout=timeout,
+        transport=httpx.HTTPTransport(
+            uds=MCP_UDS,
+            retries=3,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        ),
+        headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'RAG-System'
+        }
+    )
+
 class MCPClient:
     """Клиент для работы с AI MCP сервером"""
     
-    def __init__(self, server_url: str = "http://localhost:8000", timeout: int = 120):
+    def __init__(self, server_url: str = "http://localhost:8000", timeout: int = 120, lazy: bool = False):
         self.server_url = server_url
         self.timeout = timeout
-        self.session = requests.Session()
-        
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'RAG-System'
-        })
+        self.session = _get_session(server_url, timeout)
+        # Результаты зависят от содержимого БД: кэши сбрасываются при любой записи
+        self._search_cache = LRUCache(CLIENT_CACHE_SIZE)
+        self._rag_cache = LRUCache(CLIENT_CACHE_SIZE)
+        self._health_cache = None
+        self._health_ts = 0.0
         
         logger.info(f"Инициализация MCP клиента, сервер: {server_url}")
-        self._wait_for_server()
+        # lazy=True: без проверки сервера, доступность покажет первый запрос
+        if not lazy:
+            self._wait_for_server()
 
-    def _wait_for_server(self, max_retries: int = 10, retry_delay: int = 3):
-        """Ожидание запуска сервера с повторными попытками"""
+    def _wait_for_server(self, max_retries: int = 5, retry_delay: float = 2.0) -> bool:
+        """Ожидание запуска сервера: короткие проверки /health с ограниченным числом повторов"""
         for attempt in range(max_retries):
             try:
                 response = self.session.get(
-                    f"{self.server_url}/health",
-                    timeout=5
+                    "/health",
+                    timeout=2
                 )
-                if response.status_code == 200:
-                    health_data = response.json()
-                    logger.info("MCP сервер доступен")
-                    
-                    services = health_data.get("services", {})
-                    db_status = services.get("vector_db", "unknown")
-                    llm_status = services.get("llm_models", "unknown")
-                    
-                    logger.info(f"Статусы сервисов - БД: {db_status}, LLM: {llm_status}")
-                    logger.info(f"Доступно моделей: {health_data.get('models_available', 0)}")
-                    
-                    return True
-            except requests.exceptions.ConnectionError:
-                if attempt == 0:
-                    logger.warning("MCP сервер не отвечает, попытка подключения...")
-                else:
-                    logger.warning(f"Попытка {attempt + 1}/{max_retries}...")
+                response.raise_for_status()
+                health_data = orjson.loads(response.content)
+                logger.info("MCP сервер доступен")
+                
+                services = health_data.get("services", {})
+                db_status = services.get("vector_db", "unknown")
+                llm_status = services.get("llm_models", "unknown")
+                
+                logger.info(f"Статусы сервисов - БД: {db_status}, LLM: {llm_status}")
+                logger.info(f"Доступно моделей: {health_data.get('models_available', 0)}")
+                
+                return True
+            except (httpx.TransportError, httpx.HTTPStatusError, ValueError) as e:
+                # Сервер еще запускается (нет соединения, 5xx или неполный ответ)
+                logger.warning(f"MCP сервер не готов ({e}), попытка {attempt + 1}/{max_retries}")
             
             if attempt < max_retries - 1:
-                sleep(retry_delay)
+                sleep(min(retry_delay, 0.5 * 2 ** attempt))
         
         logger.error(f"Не удалось подключиться к MCP серверу после {max_retries} попыток")
         return False
 
+    def invalidate_cache(self):
+        """Сброс клиентских кэшей после изменения базы знаний"""
+        self._search_cache.clear()
+        self._rag_cache.clear()
+
+    def reset_after_clear(self):
+        """Сброс кэшей после очистки БД"""
+        self.invalidate_cache()
+
     def search_documents(self, query: str, top_k: int = 3) -> List[str]:
         """Поиск документов через MCP сервер"""
         try:
+            cache_key = (" ".join(query.lower().split()), top_k)
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Поиск документов (из кэша): {query}")
+                return list(cached)
+            
             logger.info(f"Поиск документов: {query}")
             
             payload = {
@@ -68,24 +149,21 @@ class MCPClient:
                 "top_k": top_k
             }
             
-            response = self.session.post(
-                f"{self.server_url}/search",
-                json=payload,
-                timeout=self.timeout
-            )
+            response = self.session.post("/search", content=orjson.dumps(payload))
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 documents = result.get("documents", [])
                 timing = result.get("timing", {})
                 
                 logger.info(f"Найдено {len(documents)} документов за {timing.get('total', 0)} сек")
+                self._search_cache.put(cache_key, tuple(documents))
                 return documents
             else:
                 logger.error(f"Ошибка поиска: {response.status_code}")
                 return []
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Сетевая ошибка при поиске: {e}")
             return []
         except Exception as e:
@@ -105,16 +183,13 @@ class MCPClient:
                 "metadata": metadata
             }
             
-            response = self.session.post(
-                f"{self.server_url}/add",
-                json=payload,
-                timeout=self.timeout
-            )
+            response = self.session.post("/add", **_compressed_body(payload))
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 success = result.get("success", False)
                 if success:
+                    self.invalidate_cache()
                     doc_id = result.get("doc_id")
                     logger.info(f"Документ добавлен, ID: {doc_id}")
                 return success
@@ -122,23 +197,64 @@ class MCPClient:
                 logger.error(f"Ошибка добавления: {response.status_code}")
                 return False
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Сетевая ошибка при добавлении: {e}")
             return False
         except Exception as e:
             logger.error(f"Ошибка при добавлении: {e}")
             return False
 
+    def add_documents_batch(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Пакетное добавление документов одним запросом; возвращает число документов в БД из пакета"""
+        try:
+            if metadatas is None:
+                metadatas = [{"source": "rag_system", "type": "fact"} for _ in texts]
+            
+            # Повторы отсеивает сервер по ID из хэша содержимого (skipped в ответе):
+            # клиентский учет отправленного терял бы записи после очистки БД другим клиентом
+            logger.info(f"Пакетное добавление документов: {len(texts)}")
+            
+            payload = [
+                {"text": text, "metadata": metadata}
+                for text, metadata in zip(texts, metadatas)
+            ]
+            
+            response = self.session.post("/batch_add", **_compressed_body(payload))
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                if not result.get("success", False):
+                    return 0
+                self.invalidate_cache()
+                added = result.get("count", 0)
+                logger.info(f"Добавлено документов: {added}, уже были в БД: {result.get('skipped', 0)}")
+                return added + result.get("skipped", 0)
+            elif response.status_code == 404:
+                # Старый сервер без /batch_add: по одному документу, запросы идут параллельно
+                logger.warning("Эндпоинт /batch_add недоступен, документы добавляются по одному")
+                with ThreadPoolExecutor(max_workers=min(FALLBACK_WORKERS, len(texts))) as executor:
+                    return sum(executor.map(self.add_document, texts, metadatas))
+            else:
+                logger.error(f"Ошибка пакетного добавления: {response.status_code}")
+                return 0
+                
+        except httpx.HTTPError as e:
+            logger.error(f"Сетевая ошибка при пакетном добавлении: {e}")
+            return 0
+        except Exception as e:
+            logger.error(f"Ошибка при пакетном добавлении: {e}")
+            return 0
+
     def get_collection_info(self) -> Dict[str, Any]:
         """Получение информации о коллекции"""
         try:
             response = self.session.get(
-                f"{self.server_url}/info",
+                "/info",
                 timeout=10
             )
             
             if response.status_code == 200:
-                return response.json()
+                return orjson.loads(response.content)
             else:
                 logger.error(f"Ошибка получения информации: {response.status_code}")
                 return {"document_count": 0}
@@ -158,14 +274,10 @@ class MCPClient:
                 "options": options or {}
             }
             
-            response = self.session.post(
-                f"{self.server_url}/generate",
-                json=payload,
-                timeout=self.timeout
-            )
+            response = self.session.post("/generate", content=orjson.dumps(payload))
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 response_text = result.get("response", "")
                 gen_time = result.get("generation_time", 0)
                 
@@ -179,16 +291,46 @@ class MCPClient:
             logger.error(f"Ошибка генерации: {e}")
             return ""
 
+    def _stream_events(self, path: str, payload: Dict[str, Any]) -> Iterator[str]:
+        """Токены из потокового ответа сервера (server-sent events); при сбое - RuntimeError"""
+        try:
+            with self.session.stream("POST", path, content=orjson.dumps({**payload, "stream": True})) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"статус {response.status_code}")
+                for line in response.iter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = orjson.loads(line[6:])
+                    if event.get("done"):
+                        if "error" in event:
+                            raise RuntimeError(event["error"])
+                        return
+                    yield event.get("response", "")
+        except Exception as e:
+            # Вызывающий код должен отличать оборванный поток от полного ответа
+            logger.error(f"Ошибка потоковой генерации: {e}")
+            raise RuntimeError(f"Ошибка потоковой генерации: {e}") from e
+
+    def generate_text_stream(self, prompt: str, model: str = "llama3.2:3b", options: Optional[Dict] = None) -> Iterator[str]:
+        """Потоковая генерация текста: токены отдаются по мере генерации"""
+        logger.info(f"Потоковая генерация текста моделью {model}")
+        yield from self._stream_events("/generate", {"model": model, "prompt": prompt, "options": options or {}})
+
+    def rag_query_stream(self, query: str, model: str = "llama3.2:3b", top_k: int = 3) -> Iterator[str]:
+        """Потоковый RAG запрос: токены ответа отдаются по мере генерации"""
+        logger.info(f"Потоковый RAG запрос: {query}")
+        yield from self._stream_events("/rag", {"query": query, "model": model, "top_k": top_k})
+
     def list_models(self) -> List[str]:
         """Получение списка доступных моделей"""
         try:
             response = self.session.get(
-                f"{self.server_url}/models",
+                "/models",
                 timeout=10
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 models = result.get("models", [])
                 model_names = [model['name'] for model in models]
                 
@@ -202,9 +344,16 @@ class MCPClient:
             logger.error(f"Ошибка получения моделей: {e}")
             return []
 
-    def rag_query(self, query: str, model: str = "llama3.2:3b", top_k: int = 3) -> Dict[str, Any]:
-        """RAG запрос через MCP сервер"""
+    def rag_query(self, query: str, model: str = "llama3.2:3b", top_k: int = 3, cache: bool = False) -> Dict[str, Any]:
+        """RAG запрос через MCP сервер (cache=True - повторный вопрос отвечается из кэша клиента)"""
         try:
+            cache_key = (" ".join(query.lower().split()), model, top_k)
+            if cache:
+                cached = self._rag_cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"RAG ответ из кэша: {query}")
+                    return dict(cached)
+            
             logger.info(f"RAG запрос: {query}")
             
             payload = {
@@ -213,51 +362,91 @@ class MCPClient:
                 "top_k": top_k
             }
             
-            response = self.session.post(
-                f"{self.server_url}/rag",
-                json=payload,
-                timeout=self.timeout
-            )
+            response = self.session.post("/rag", content=orjson.dumps(payload))
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 timing = result.get("timing", {})
                 
                 logger.info(f"RAG ответ получен за {timing.get('total', 0)} сек")
+                if cache:
+                    self._rag_cache.put(cache_key, result)
                 return result
             else:
                 logger.error(f"Ошибка RAG: {response.status_code}")
-                return {"answer": "Ошибка при обработке запроса", "documents_found": 0}
+                return {"answer": "Ошибка при обработке запроса", "documents_found": 0, "error": True}
                 
         except Exception as e:
             logger.error(f"Ошибка RAG: {e}")
-            return {"answer": "Ошибка при обработке запроса", "documents_found": 0}
+            return {"answer": "Ошибка при обработке запроса", "documents_found": 0, "error": True}
 
-    def is_server_running(self) -> bool:
-        """Проверка доступности сервера"""
+    def rag_query_batch(self, queries: List[str], model: str = "llama3.2:3b", top_k: int = 3) -> List[Dict[str, Any]]:
+        """Пакетный RAG запрос: результаты в порядке запросов"""
+        error_result = {"answer": "Ошибка при обработке запроса", "documents_found": 0, "error": True}
         try:
-            response = self.session.get(
-                f"{self.server_url}/health",
-                timeout=5
-            )
-            return response.status_code == 200
-        except:
-            return False
+            logger.info(f"Пакетный RAG запрос: {len(queries)} вопросов")
+            
+            payload = {
+                "queries": queries,
+                "model": model,
+                "top_k": top_k
+            }
+            
+            response = self.session.post("/rag_batch", content=orjson.dumps(payload))
+            
+            if response.status_code == 200:
+                return orjson.loads(response.content).get("results", [])
+            elif response.status_code == 404:
+                # Старый сервер без /rag_batch: по одному запросу
+                logger.warning("Эндпоинт /rag_batch недоступен, запросы выполняются по одному")
+                return [self.rag_query(query, model, top_k) for query in queries]
+            else:
+                logger.error(f"Ошибка пакетного RAG: {response.status_code}")
+                return [dict(error_result) for _ in queries]
+                
+        except Exception as e:
+            logger.error(f"Ошибка пакетного RAG: {e}")
+            return [dict(error_result) for _ in queries]
+
+    def is_server_running(self, force_refresh: bool = False) -> bool:
+        """Проверка доступности сервера"""
+        return bool(self.get_server_info(force_refresh))
 
-    def get_server_info(self) -> Dict[str, Any]:
-        """Получение информации о сервере"""
+    def get_server_info(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """Получение информации о сервере (ответ /health кэшируется на HEALTH_TTL секунд)"""
+        now = monotonic()
+        if not force_refresh and self._health_cache and now - self._health_ts < HEALTH_TTL:
+            return self._health_cache
         try:
-            response = self.session.get(f"{self.server_url}/health")
+            response = self.session.get("/health", timeout=5)
             if response.status_code == 200:
-                return response.json()
+                self._health_cache = orjson.loads(response.content)
+                self._health_ts = now
+                return self._health_cache
             return {}
-        except:
+        except Exception:
             return {}
 
-    def __del__(self):
-        """Закрытие сессии при уничтожении объекта"""
-        if hasattr(self, 'session'):
-            self.session.close()
+    def get_full_status(self) -> Dict[str, Any]:
+        """Состояние сервера, модели и коллекция одним запросом (пустой словарь - сервер недоступен)"""
+        try:
+            response = self.session.get("/status", timeout=10)
+            if response.status_code == 200:
+                return orjson.loads(response.content)
+            if response.status_code == 404:
+                # Старый сервер без /status: собираем из отдельных эндпоинтов
+                server_info = self.get_server_info()
+                if not server_info:
+                    return {}
+                return {
+                    **server_info,
+                    "models": self.list_models(),
+                    "collection": self.get_collection_info()
+                }
+            return {}
+        except Exception as e:
+            logger.error(f"Ошибка получения статуса сервера: {e}")
+            return {}
 
     def clear_database(self) -> bool:
         """Очистка базы данных через MCP сервер"""
@@ -265,13 +454,14 @@ class MCPClient:
             logger.info("Очистка базы данных...")
             
             response = self.session.post(
-                f"{self.server_url}/clear",
+                "/clear",
                 timeout=30
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 deleted = result.get('deleted_count', 0)
+                self.reset_after_clear()
                 logger.info(f"База данных очищена. Удалено документов: {deleted}")
                 return True
             else:
@@ -280,4 +470,91 @@ class MCPClient:
                 
         except Exception as e:
             logger.error(f"Ошибка при очистке базы данных: {e}")
-            return False
\ No newline at end of file
+            return False
+
+@lru_cache(maxsize=None)
+def get_mcp_client(server_url: str = "http://localhost:8000", timeout: int = 120) -> MCPClient:
+    """Один клиент на процесс: повторное создание RAG-системы переиспользует его кэши и статус"""
+    return MCPClient(server_url, timeout, lazy=True)
+
+class AsyncMCPClient:
+    """Асинхронный клиент MCP сервера для параллельных запросов из одного потока"""
+    
+    def __init__(self, server_url: str = "http://localhost:8000", timeout: int = 120):
+        self.server_url = server_url
+        self.timeout = timeout
+        # Каждый одновременный запрос занимает свое keep-alive соединение из пула
+        self.client = httpx.AsyncClient(
+            base_url=server_url,
+            timeout=timeout,
+            transport=httpx.AsyncHTTPTransport(
+                uds=MCP_UDS,
+                retries=3,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            ),
+            headers={
+                'Content-Type': 'application/json',
+                'User-Agent': 'RAG-System'
+            }
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        await self.client.aclose()
+
+    async def search_documents(self, query: str, top_k: int = 3) -> List[str]:
+        """Поиск документов через MCP сервер"""
+        try:
+            response = await self.client.post("/search", content=orjson.dumps({"query": query, "top_k": top_k}))
+            
+            if response.status_code == 200:
+                return orjson.loads(response.content).get("documents", [])
+            logger.error(f"Ошибка поиска: {response.status_code}")
+            return []
+                
+        except Exception as e:
+            logger.error(f"Ошибка при поиске: {e}")
+            return []
+
+    async def add_document(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Добавление документа через MCP сервер"""
+        try:
+            if metadata is None:
+                metadata = {"source": "rag_system", "type": "fact"}
+            
+            response = await self.client.post("/add", **_compressed_body({"text": text, "metadata": metadata}))
+            
+            if response.status_code == 200:
+                return orjson.loads(response.content).get("success", False)
+            logger.error(f"Ошибка добавления: {response.status_code}")
+            return False
+                
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении: {e}")
+            return False
+
+    async def rag_query(self, query: str, model: str = "llama3.2:3b", top_k: int = 3) -> Dict[str, Any]:
+        """RAG запрос через MCP сервер"""
+        try:
+            payload = {
+                "query": query,
+                "model": model,
+                "top_k": top_k
+            }
+            
+            response = await self.client.post("/rag", content=orjson.dumps(payload))
+            
+            if response.status_code == 200:
+                return orjson.loads(response.content)
+            logger.error(f"Ошибка RAG: {response.status_code}")
+            return {"answer": "Ошибка при обработке запроса", "documents_found": 0, "error": True}
+                
+        except Exception as e:
+            logger.error(f"Ошибка RAG: {e}")
+            return {"answer": "Ошибка при обработке запроса", "documents_found": 0, "error": True}
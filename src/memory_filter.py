@@ -0,0 +1,46 @@
+import hashlib
+import re
+import threading
+from collections import deque
+
+# Сколько последних сохраненных реплик помнить и максимальное расстояние Хэмминга
+# между 64-битными SimHash, при котором реплика считается почти дубликатом
+RECENT_SIGNATURES_SIZE = 500
+NEAR_DUPLICATE_DISTANCE = 6
+
+WORD_RE = re.compile(r"\w+")
+
+def simhash(text: str) -> int:
+    """64-битный SimHash текста по словам"""
+    weights = [0] * 64
+    for word in WORD_RE.findall(text.lower()):
+        word_hash = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if word_hash >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+class NearDuplicateFilter:
+    """Отсев почти повторяющихся реплик до записи в векторную БД"""
+
+    def __init__(self, max_size: int = RECENT_SIGNATURES_SIZE, max_distance: int = NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        self._signatures = deque(maxlen=max_size)
+        # remember() вызывается из фонового потока записи, seen() - из основного
+        self._lock = threading.Lock()
+
+    def seen(self, text: str) -> bool:
+        """True, если похожий текст уже запомнен (без изменения состояния)"""
+        signature = simhash(text)
+        with self._lock:
+            return any((signature ^ other).bit_count() <= self.max_distance for other in self._signatures)
+
+    def remember(self, text: str):
+        """Запомнить текст (после успешной записи в БД)"""
+        signature = simhash(text)
+        with self._lock:
+            self._signatures.append(signature)
+
+    def clear(self):
+        """Забыть все сигнатуры (после очистки БД)"""
+        with self._lock:
+            self._signatures.clear()
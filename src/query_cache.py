@@ -0,0 +1,56 @@
+import re
+import time
+from collections import OrderedDict
+from threading import RLock
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Ключ кэша: запрос без регистра и лишних пробелов"""
+    return WHITESPACE_RE.sub(" ", query.strip().lower())
+
+class QueryCache:
+    """Потокобезопасный LRU-кэш ответов на запросы с ограниченным временем жизни"""
+
+    def __init__(self, max_size: int = 512, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """Ответ по ключу из normalize_query или None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, answer):
+        with self._lock:
+            self._data[key] = (time.monotonic(), answer)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self) -> dict:
+        """Попадания, промахи и доля попаданий"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
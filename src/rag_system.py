@@ -1,7 +1,15 @@
+import atexit
 import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Iterator, List
 from config import *
-from mcp_client import MCPClient
+from mcp_client import AsyncMCPClient, get_mcp_client
+from memory_filter import NearDuplicateFilter
+from query_cache import QueryCache, normalize_query
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,23 +17,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Фразы, при которых ответ не сохраняется в память, и приветствия в запросе:
+# одна скомпилированная альтернатива без учета регистра, без копии строки в lower()
+FORBIDDEN_PHRASES_RE = re.compile("|".join(map(re.escape, [
+    "разъясняя ответ", "контекст из базы знаний",
+    "отправляй наш вопрос", "неизвестно", "не знаю",
+    "контекст:", "вопрос:", "ответ:"
+])), re.IGNORECASE)
+GREETINGS_RE = re.compile("|".join(map(re.escape, ["привет", "здравствуй", "hello"])), re.IGNORECASE)
+
+# Запрос из одного приветствия отвечается сразу, без эмбеддинга, поиска и генерации
+GREETING_ONLY_RE = re.compile(r"(привет|здравствуй(те)?|добрый день|hello|hi)[\s!.,]*", re.IGNORECASE)
+GREETING_ANSWER = "Здравствуйте! Задайте вопрос, и я поищу ответ в базе знаний."
+
+# Промпт прямого режима: шаблон задается один раз, меняются только контекст и вопрос
+RAG_PROMPT_TEMPLATE = """Ты - полезный ассистент с доступом к базе знаний. Ответь на вопрос используя контекст.
+
+КОНТЕКСТ:
+{context}
+
+ВОПРОС: {query}
+
+ОТВЕТ:"""
+
+# Окно контекста и стоп-последовательность те же, что у MCP сервера (RAG_OPTIONS в ai_mcp_server.py):
+# модель иногда продолжает ответ выдуманным следующим вопросом, генерация на нем обрывается
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+RAG_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "stop": ["\nВОПРОС:"]}
+# Бюджет контекста в символах: документы берутся целиком, не поместившиеся отбрасываются
+RAG_CONTEXT_MAX_CHARS = 3000
+
+# Реплик (пар вопрос-ответ) истории диалога в памяти: старые вытесняются
+DIALOG_HISTORY_SIZE = 200
+
 class RAGSystem:
-    def __init__(self, model_name=MODEL_NAME, use_mcp=True):
+    def __init__(self, model_name=MODEL_NAME, use_mcp=MCP_MODE != "local"):
         self.model_name = model_name
-        self.dialog_history = []
+        self.dialog_history = deque(maxlen=DIALOG_HISTORY_SIZE)
+        self._saved_dialogs = NearDuplicateFilter()
+        self.query_cache = QueryCache(max_size=512, ttl=300)
+        # Запись диалогов в память идет в фоне; один поток сохраняет порядок записей
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-writer")
+        # Если close() не вызван явно, фоновые записи завершаются при выходе
+        atexit.register(self.close)
         self.use_mcp = use_mcp
         
         if self.use_mcp:
             try:
-                self.mcp_client = MCPClient()
-                if self.mcp_client.is_server_running():
-                    server_info = self.mcp_client.get_server_info()
-                    services = server_info.get("services", {})
+                # Отдельная проверка /health не нужна: /status одновременно проверяет доступность
+                self.mcp_client = get_mcp_client()
+                # Состояние сервисов и список моделей - одним запросом
+                status = self.mcp_client.get_full_status()
+                if status:
+                    services = status.get("services", {})
                     
                     logger.info("RAG система инициализирована с MCP клиентом")
                     logger.info(f"Статус сервисов: БД({services.get('vector_db', 'unknown')})")
                     
-                    available_models = self.mcp_client.list_models()
+                    available_models = status.get("models", [])
                     if available_models:
                         logger.info(f"Доступные модели: {', '.join(available_models)}")
                     else:
@@ -36,10 +85,12 @@ class RAGSystem:
             except Exception as e:
                 logger.error(f"Ошибка инициализации MCP клиента: {e}")
                 self.use_mcp = False
-        else:
-            from vector_db import VectorStore
+        
+        # Без сервера (MCP_MODE=local или он недоступен) БД и LLM вызываются в процессе
+        if not self.use_mcp:
+            from vector_db import create_vector_store
             import ollama
-            self.vector_db = VectorStore()
+            self.vector_db = create_vector_store()
             self.ollama_client = ollama.Client()
             logger.info("RAG система инициализирована с прямыми вызовами")
     
@@ -56,37 +107,30 @@ class RAGSystem:
         print("Загрузка начальной базы знаний...")
         
         success_count = 0
-        for knowledge in initial_knowledge:
-            if self.use_mcp:
-                success = self.mcp_client.add_document(
-                    knowledge, 
-                    {"source": "base_knowledge", "type": "fact"}
-                )
-                if success:
-                    success_count += 1
-                    print(f"Добавлено: {knowledge[:50]}...")
-                else:
-                    print(f"Ошибка добавления: {knowledge[:50]}...")
-            else:
-                self.vector_db.add_documents(
-                    [knowledge], 
-                    [{"source": "base_knowledge", "type": "fact"}]
-                )
-                success_count += 1
+        # Все факты эмбеддятся одним проходом модели и пишутся одним запросом
+        metadatas = [{"source": "base_knowledge", "type": "fact"} for _ in initial_knowledge]
+        if self.use_mcp:
+            success_count = self.mcp_client.add_documents_batch(initial_knowledge, metadatas)
+        else:
+            if self.vector_db.add_documents(initial_knowledge, metadatas):
+                success_count = len(initial_knowledge)
         
         print(f"Всего добавлено документов: {success_count}/{len(initial_knowledge)}")
         
         if self.use_mcp:
-            info = self.mcp_client.get_collection_info()
-            print(f"Всего документов в базе: {info.get('document_count', 0)}")
-            
-            server_info = self.mcp_client.get_server_info()
-            print(f"Доступно моделей на сервере: {server_info.get('models_available', 0)}")
+            status = self.mcp_client.get_full_status()
+            print(f"Всего документов в базе: {status.get('collection', {}).get('document_count', 0)}")
+            print(f"Доступно моделей на сервере: {status.get('models_available', 0)}")
 
     def process_query(self, user_query: str) -> str:
         """Основной метод обработки запроса"""
         logger.info(f"Получен запрос: {user_query}")
         
+        cache_key = normalize_query(user_query)
+        ready_answer = self._ready_answer(user_query, cache_key)
+        if ready_answer is not None:
+            return ready_answer
+        
         if self.use_mcp:
             result = self.mcp_client.rag_query(
                 query=user_query,
@@ -95,57 +139,157 @@ class RAGSystem:
             )
             
             answer = result.get("answer", "Ошибка при обработке запроса")
+            # Ответ-заглушка об ошибке не кэшируется и не сохраняется в память
+            if result.get("error") or "answer" not in result:
+                self.dialog_history.append((user_query, answer))
+                return answer
             documents_found = result.get("documents_found", 0)
             timing = result.get("timing", {})
             
             logger.info(f"RAG ответ: {documents_found} док., {timing.get('total', 0)} сек")
             
         else:
-            relevant_docs = self.vector_db.search_similar(user_query)
-            context = "\n".join(relevant_docs) if relevant_docs else "Информация не найдена в базе знаний."
-            
-            prompt = f"""Ты - полезный ассистент с доступом к базе знаний. Ответь на вопрос используя контекст.
-
-КОНТЕКСТ:
-{context}
-
-ВОПРОС: {user_query}
-
-ОТВЕТ:"""
-            
             response = self.ollama_client.generate(
                 model=self.model_name,
-                prompt=prompt
+                prompt=self._local_prompt(user_query),
+                options=RAG_OPTIONS
             )
             answer = response['response'].strip()
         
-        self.dialog_history.extend([f"User: {user_query}", f"Assistant: {answer}"])
+        self._record_answer(user_query, cache_key, answer)
+        return answer
+    
+    def _ready_answer(self, user_query: str, cache_key: str):
+        """Ответ без поиска и генерации (приветствие или повтор недавнего вопроса) либо None"""
+        if GREETING_ONLY_RE.fullmatch(user_query.strip()):
+            self.dialog_history.append((user_query, GREETING_ANSWER))
+            return GREETING_ANSWER
+        
+        # Нормализованный ключ считается один раз на весь запрос
+        cached_answer = self.query_cache.get(cache_key)
+        if cached_answer is not None:
+            logger.info(f"[CACHE HIT] {user_query}")
+            self.dialog_history.append((user_query, cached_answer))
+        return cached_answer
+    
+    def _record_answer(self, user_query: str, cache_key: str, answer: str):
+        """История, фоновое сохранение в память и кэш для полученного ответа"""
+        self.dialog_history.append((user_query, answer))
         
         if self.should_save_to_memory(user_query, answer):
-            self.save_to_memory(user_query, answer)
+            self.save_in_background(user_query, answer)
         
-        return answer
+        # Кладется после сброса кэша: запись собственного диалога не вытесняет этот ответ
+        self.query_cache.put(cache_key, answer)
+    
+    def _local_prompt(self, user_query: str) -> str:
+        """Промпт прямого режима: найденные документы целиком в пределах бюджета контекста"""
+        # Точные повторы фрагментов попадают в промпт один раз (как _distinct_documents у сервера)
+        relevant_docs = list(dict.fromkeys(self.vector_db.search_similar(user_query)))
+        parts, size = [], 0
+        for document in relevant_docs:
+            size += len(document) + (1 if parts else 0)
+            if size > RAG_CONTEXT_MAX_CHARS:
+                break
+            parts.append(document)
+        if not parts and relevant_docs:
+            # Единственный слишком длинный документ режется по границе слова
+            head = relevant_docs[0][:RAG_CONTEXT_MAX_CHARS]
+            cut = head.rfind(" ")
+            parts = [head[:cut] if cut > 0 else head]
+        context = "\n".join(parts) if parts else "Информация не найдена в базе знаний."
+        return RAG_PROMPT_TEMPLATE.format(context=context, query=user_query)
+    
+    def process_query_stream(self, user_query: str) -> Iterator[str]:
+        """Обработка запроса с выдачей ответа по частям по мере генерации"""
+        logger.info(f"Получен запрос: {user_query}")
+        
+        cache_key = normalize_query(user_query)
+        ready_answer = self._ready_answer(user_query, cache_key)
+        if ready_answer is not None:
+            yield ready_answer
+            return
+        
+        parts = []
+        failed = False
+        try:
+            if self.use_mcp:
+                tokens = self.mcp_client.rag_query_stream(user_query, model=self.model_name, top_k=3)
+            else:
+                prompt = self._local_prompt(user_query)
+                tokens = (
+                    chunk['response']
+                    for chunk in self.ollama_client.generate(model=self.model_name, prompt=prompt, options=RAG_OPTIONS, stream=True)
+                )
+            for token in tokens:
+                parts.append(token)
+                yield token
+        except Exception as e:
+            logger.error(f"Ошибка потокового ответа: {e}")
+            failed = True
+        
+        answer = "".join(parts).strip()
+        if failed or not answer:
+            # Оборванный или пустой поток не кэшируется и не сохраняется в память
+            if not answer:
+                answer = "Ошибка при обработке запроса"
+                yield answer
+            self.dialog_history.append((user_query, answer))
+            return
+        
+        self._record_answer(user_query, cache_key, answer)
+    
+    def process_queries(self, queries: List[str]) -> List[str]:
+        """Обработка пакета независимых запросов (оценка, офлайн-прогоны)"""
+        if not self.use_mcp:
+            return [self.process_query(query) for query in queries]
+        
+        logger.info(f"Получен пакет запросов: {len(queries)}")
+        results = self.mcp_client.rag_query_batch(queries, model=self.model_name, top_k=3)
+        return self._record_answers(queries, results)
+    
+    def _record_answers(self, queries: List[str], results: List[dict]) -> List[str]:
+        """История диалога и сохранение в память для пакета ответов сервера"""
+        answers = []
+        for query, result in zip(queries, results):
+            answer = result.get("answer", "Ошибка при обработке запроса")
+            self.dialog_history.append((query, answer))
+            failed = result.get("error") or "answer" not in result
+            if not failed and self.should_save_to_memory(query, answer):
+                self.save_in_background(query, answer)
+            answers.append(answer)
+        return answers
+    
+    async def process_queries_async(self, queries: List[str]) -> List[str]:
+        """Параллельная обработка независимых запросов отдельными вызовами /rag"""
+        if not self.use_mcp:
+            return [self.process_query(query) for query in queries]
+        
+        # asyncio нужен только этому пути, обычный запуск его не загружает
+        import asyncio
+        async with AsyncMCPClient(self.mcp_client.server_url, self.mcp_client.timeout) as client:
+            results = await asyncio.gather(
+                *(client.rag_query(query, model=self.model_name, top_k=3) for query in queries)
+            )
+        return self._record_answers(queries, results)
     
     def should_save_to_memory(self, query: str, response: str) -> bool:
         """Определяет, стоит ли сохранять ответ в память"""
         if not response or len(response) < 10:
             return False
         
-        forbidden_phrases = [
-            "разъясняя ответ", "контекст из базы знаний", 
-            "отправляй наш вопрос", "неизвестно", "не знаю",
-            "контекст:", "вопрос:", "ответ:"
-        ]
-        
-        response_lower = response.lower()
-        if any(phrase in response_lower for phrase in forbidden_phrases):
+        if FORBIDDEN_PHRASES_RE.search(response):
             return False
             
-        if any(word in query.lower() for word in ["привет", "здравствуй", "hello"]):
+        if GREETINGS_RE.search(query):
             return False
             
         if len(response.split('.')) < 1:
             return False
+        
+        # Почти повтор уже сохраненной реплики не эмбеддится и не пишется заново
+        if self._saved_dialogs.seen(f"{query}\n{response}"):
+            return False
             
         return True
     
@@ -159,29 +303,43 @@ class RAGSystem:
             
             metadata = {
                 "type": "dialog",
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
                 "source": "generated"
             }
             
-            for fact in facts_to_save:
-                if self.use_mcp:
-                    self.mcp_client.add_document(fact, metadata)
-                else:
-                    self.vector_db.add_documents([fact], [metadata])
-                    
+            metadatas = [metadata for _ in facts_to_save]
+            if self.use_mcp:
+                saved = self.mcp_client.add_documents_batch(facts_to_save, metadatas) == len(facts_to_save)
+            else:
+                saved = self.vector_db.add_documents(facts_to_save, metadatas)
+            if not saved:
+                logger.warning("Диалог не сохранен в память")
+                return
+            
+            # Сигнатура запоминается только после записи: неудачная попытка не блокирует повтор
+            self._saved_dialogs.remember(f"{query}\n{response}")
             logger.info("Информация сохранена в память")
         except Exception as e:
             logger.error(f"Ошибка сохранения в память: {e}")
     
+    def save_in_background(self, query: str, response: str):
+        """Сохранение в память без ожидания ответа сервера"""
+        # Новые документы могут изменить ответы на закэшированные вопросы
+        self.query_cache.clear()
+        self._writer.submit(self.save_to_memory, query, response)
+    
+    def close(self):
+        """Дожидается фоновых записей в память"""
+        self._writer.shutdown(wait=True)
+    
     def get_system_info(self) -> dict:
         """Получение информации о системе"""
         if self.use_mcp:
-            db_info = self.mcp_client.get_collection_info()
-            server_info = self.mcp_client.get_server_info()
-            models = self.mcp_client.list_models()
+            status = self.mcp_client.get_full_status()
+            models = status.get("models", [])
             
-            doc_count = db_info.get("document_count", 0)
-            models_available = server_info.get("models_available", 0)
+            doc_count = status.get("collection", {}).get("document_count", 0)
+            models_available = status.get("models_available", 0)
             
         else:
             db_info = self.vector_db.get_collection_info()
@@ -196,7 +354,8 @@ class RAGSystem:
             "documents_in_db": doc_count,
             "models_available": models_available,
             "available_models": models,
-            "mcp_available": self.mcp_client.is_server_running() if self.use_mcp else False
+            "mcp_available": bool(status) if self.use_mcp else False,
+            "query_cache": self.query_cache.get_stats()
         }
     
     def test_model_generation(self, prompt: str = "Напиши коротко о искусственном интеллекте") -> str:
@@ -1,6 +1,8 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+import hashlib
+import json
 import logging
+import os
+from functools import lru_cache
 from pathlib import Path
 
 # Настройки (на случай если config не импортируется)
@@ -10,32 +12,156 @@ VECTOR_DB_DIR = DATA_DIR / "chroma_db"
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 CHROMA_COLLECTION_NAME = "diplom_rag_memory"
 TOP_K_RESULTS = 3
+# ONNX Runtime с int8-весами; EMBEDDING_BACKEND=torch возвращает FP32 PyTorch,
+# EMBEDDING_BACKEND=openvino - OpenVINO (процессоры Intel),
+# EMBEDDING_BACKEND=model2vec - статическую дистилляцию модели (scripts/distill_embedder.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+EMBEDDING_STATIC_MODEL = os.getenv("EMBEDDING_STATIC_MODEL", str(DATA_DIR / "m2v-mini"))
+# EMBEDDING_COMPILE=1: torch.compile для PyTorch-бэкенда (долгий первый запуск, быстрее encode)
+EMBEDDING_COMPILE = os.getenv("EMBEDDING_COMPILE", "0") == "1"
+# Параметры HNSW для новой коллекции: search_ef по умолчанию (10) дает низкий recall;
+# векторы нормируются при эмбеддинге, поэтому косинус сводится к скалярному произведению
+HNSW_METADATA = {"hnsw:space": "ip", "hnsw:construction_ef": 200, "hnsw:M": 16, "hnsw:search_ef": 64}
+# Документов в одном проходе модели при добавлении и в одной записи в Chroma
+ENCODE_BATCH_SIZE = 64
+CHROMA_ADD_BATCH_SIZE = 1000
+# Хранилище векторов: chroma (HNSW с метаданными) или faiss - точный поиск IndexFlatIP
+# по нормированным векторам для небольших локальных баз (pip install faiss-cpu)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Векторы (float32 подряд) и документы (JSON Lines) только дописываются в конец файлов;
+# у статической модели другая размерность, поэтому свои файлы, как и коллекция _m2v
+_FAISS_SUFFIX = "_m2v" if EMBEDDING_BACKEND == "model2vec" else ""
+FAISS_VECTORS_PATH = VECTOR_DB_DIR / f"faiss{_FAISS_SUFFIX}.f32"
+FAISS_DOCS_PATH = VECTOR_DB_DIR / f"faiss_docs{_FAISS_SUFFIX}.jsonl"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _doc_id(text):
+    """Стабильный ID документа по содержимому (тот же, что у MCP сервера)"""
+    return "doc_" + hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+def _compile_transformer(embedder):
+    """torch.compile трансформера PyTorch-бэкенда; граф захватывается прогревочным encode"""
+    import torch
+    module = embedder[0]
+    if not hasattr(module, "auto_model"):
+        return
+    original = module.auto_model
+    try:
+        module.auto_model = torch.compile(original, dynamic=True)
+        embedder.encode(["warmup"])
+    except Exception as e:
+        module.auto_model = original
+        logger.warning(f"⚠️ torch.compile недоступен ({e}), модель работает без компиляции")
+
+@lru_cache(maxsize=1)
+def get_embedder(model_name=EMBEDDING_MODEL):
+    """Модель эмбеддингов, общая для всех VectorStore процесса (int8 ONNX с откатом на PyTorch)"""
+    # torch и sentence_transformers импортируются только при первой загрузке модели;
+    # в CLI нет fork, поэтому Rust-токенизатор может работать в нескольких потоках
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+    import torch
+    from sentence_transformers import SentenceTransformer
+    
+    torch.set_num_threads(os.cpu_count() or 1)
+    
+    if EMBEDDING_BACKEND == "model2vec":
+        from sentence_transformers.models import StaticEmbedding
+        return SentenceTransformer(modules=[StaticEmbedding.from_model2vec(EMBEDDING_STATIC_MODEL)])
+    if EMBEDDING_BACKEND == "onnx":
+        try:
+            return SentenceTransformer(
+                model_name,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ ONNX бэкенд недоступен ({e}), используется PyTorch")
+    if EMBEDDING_BACKEND == "openvino":
+        try:
+            return SentenceTransformer(model_name, backend="openvino")
+        except Exception as e:
+            logger.warning(f"⚠️ OpenVINO бэкенд недоступен ({e}), используется PyTorch")
+    embedder = SentenceTransformer(model_name)
+    if EMBEDDING_COMPILE:
+        _compile_transformer(embedder)
+    return embedder
+
+@lru_cache(maxsize=1024)
+def _encode_query(query_norm, normalize=False):
+    """Эмбеддинг поискового запроса с LRU-кэшем на повторяющиеся запросы"""
+    embedding = get_embedder().encode([query_norm], convert_to_numpy=True, normalize_embeddings=normalize)
+    embedding.flags.writeable = False
+    return embedding
+
 class VectorStore:
     def __init__(self):
+        # chromadb загружается только для этого бэкенда (с VECTOR_BACKEND=faiss не нужен)
+        import chromadb
+        from chromadb.config import Settings
+        
         logger.info("🔄 Инициализация векторной базы данных...")
-        self.client = chromadb.PersistentClient(path=str(VECTOR_DB_DIR))
-        self.collection = self.client.get_or_create_collection(CHROMA_COLLECTION_NAME)
-        self.embedder = SentenceTransformer(EMBEDDING_MODEL)
+        self.client = chromadb.PersistentClient(
+            path=str(VECTOR_DB_DIR),
+            settings=Settings(anonymized_telemetry=False)
+        )
+        # Векторы статической модели другой размерности: отдельная коллекция
+        collection_name = CHROMA_COLLECTION_NAME
+        if EMBEDDING_BACKEND == "model2vec":
+            collection_name += "_m2v"
+        self.collection = self.client.get_or_create_collection(
+            collection_name,
+            metadata=HNSW_METADATA
+        )
+        # Коллекции, созданные раньше, остаются в L2 с ненормированными векторами
+        self._normalize = (self.collection.metadata or {}).get("hnsw:space") == "ip"
+        # Модель загружается при первом обращении и переиспользуется всеми экземплярами
+        self._embedder = None
         logger.info("✅ Векторная БД готова!")
     
-    def add_documents(self, documents, metadata_list=None):
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+    
+    def add_documents(self, documents, metadata_list=None, batch_size=ENCODE_BATCH_SIZE):
         try:
-            if metadata_list is None:
-                metadata_list = [{}] * len(documents)
-            
-            embeddings = self.embedder.encode(documents).tolist()
+            # ID по содержимому: повторный вызов не перезаписывает прежние doc_0..doc_N,
+            # а повторы и уже сохраненные документы не эмбеддятся заново
+            unique_docs = {}
+            for i, document in enumerate(documents):
+                unique_docs.setdefault(_doc_id(document), i)
+            existing_ids = set(self.collection.get(ids=list(unique_docs), include=[])["ids"])
+            doc_ids = [doc_id for doc_id in unique_docs if doc_id not in existing_ids]
+            if not doc_ids:
+                logger.info("Все документы уже есть в базе")
+                return True
             
-            self.collection.add(
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadata_list,
-                ids=[f"doc_{i}" for i in range(len(documents))]
-            )
-            logger.info(f"✅ Добавлено {len(documents)} документов")
+            # Крупные загрузки эмбеддятся и пишутся окнами: одно окно в памяти за раз
+            for start in range(0, len(doc_ids), CHROMA_ADD_BATCH_SIZE):
+                window_ids = doc_ids[start:start + CHROMA_ADD_BATCH_SIZE]
+                positions = [unique_docs[doc_id] for doc_id in window_ids]
+                texts = [documents[i] for i in positions]
+                # Chroma принимает numpy-массив напрямую, без промежуточных списков float
+                embeddings = self.embedder.encode(
+                    texts,
+                    batch_size=max(1, min(len(texts), batch_size)),
+                    show_progress_bar=False,
+                    convert_to_numpy=True,
+                    normalize_embeddings=self._normalize
+                )
+                
+                self.collection.add(
+                    embeddings=embeddings,
+                    documents=texts,
+                    # Без метаданных список не строится вовсе (а не [{}] * n с одним общим словарем)
+                    metadatas=[metadata_list[i] for i in positions] if metadata_list is not None else None,
+                    ids=window_ids
+                )
+            logger.info(f"✅ Добавлено {len(doc_ids)} документов")
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка при добавлении документов: {e}")
@@ -43,11 +169,12 @@ class VectorStore:
     
     def search_similar(self, query, top_k=TOP_K_RESULTS):
         try:
-            query_embedding = self.embedder.encode([query]).tolist()
+            query_embedding = _encode_query(" ".join(query.split()), self._normalize)
             
             results = self.collection.query(
                 query_embeddings=query_embedding,
-                n_results=top_k
+                n_results=top_k,
+                include=["documents"]
             )
             
             documents = results["documents"][0] if results["documents"] else []
@@ -63,4 +190,136 @@ class VectorStore:
             return {"document_count": count}
         except Exception as e:
             logger.error(f"❌ Ошибка получения информации: {e}")
-            return {"document_count": 0}
\ No newline at end of file
+            return {"document_count": 0}
+
+class FAISSVectorStore:
+    """Точный поиск по скалярному произведению нормированных эмбеддингов (косинусная близость)"""
+
+    def __init__(self):
+        import faiss
+        import numpy as np
+        self._faiss = faiss
+        logger.info("🔄 Инициализация FAISS индекса...")
+        self.index = None
+        self.documents = []
+        self.metadatas = []
+        self._ids = set()
+        if FAISS_VECTORS_PATH.exists() and FAISS_DOCS_PATH.exists():
+            dim = None
+            with open(FAISS_DOCS_PATH, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная последняя строка после аварийного завершения
+                        break
+                    if "dim" in record:
+                        dim = record["dim"]
+                        continue
+                    self.documents.append(record["document"])
+                    self.metadatas.append(record["metadata"])
+            vectors = np.fromfile(FAISS_VECTORS_PATH, dtype="float32")
+            if dim:
+                count = min(len(self.documents), vectors.size // dim)
+                self.index = faiss.IndexFlatIP(dim)
+                self.index.add(vectors[:count * dim].reshape(count, dim))
+                if count != len(self.documents) or vectors.size != count * dim:
+                    # Запись оборвалась между файлами: оставляется согласованная часть
+                    del self.documents[count:], self.metadatas[count:]
+                    self._rewrite(vectors[:count * dim])
+            else:
+                self.documents, self.metadatas = [], []
+            self._ids = {_doc_id(document) for document in self.documents}
+        # Модель загружается при первом обращении и переиспользуется всеми экземплярами
+        self._embedder = None
+        logger.info(f"✅ FAISS индекс готов ({len(self.documents)} документов)")
+    
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+    
+    def _rewrite(self, vectors):
+        """Полная перезапись файлов (только при восстановлении после обрыва записи)"""
+        FAISS_DOCS_PATH.unlink()
+        self._save(vectors, self.documents, self.metadatas)
+    
+    def _save(self, embeddings, documents, metadatas):
+        """Дозапись новых векторов и документов: стоимость пропорциональна вставке, а не базе"""
+        VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
+        if not (FAISS_DOCS_PATH.exists() and FAISS_VECTORS_PATH.exists()):
+            # Новая база: первой строкой размерность векторов
+            FAISS_DOCS_PATH.write_text(json.dumps({"dim": self.index.d}) + "\n", encoding="utf-8")
+            FAISS_VECTORS_PATH.write_bytes(b"")
+        # Сначала векторы: при обрыве между записями лишние векторы отбрасываются при загрузке
+        with open(FAISS_VECTORS_PATH, "ab") as f:
+            f.write(embeddings.tobytes())
+        with open(FAISS_DOCS_PATH, "a", encoding="utf-8") as f:
+            f.writelines(
+                json.dumps({"document": document, "metadata": metadata}, ensure_ascii=False) + "\n"
+                for document, metadata in zip(documents, metadatas)
+            )
+    
+    def add_documents(self, documents, metadata_list=None, batch_size=ENCODE_BATCH_SIZE):
+        try:
+            # ID по содержимому, как в VectorStore: повторная загрузка начальных фактов
+            # после перезапуска не дописывает их в индекс второй раз
+            unique_docs = {}
+            for i, document in enumerate(documents):
+                doc_id = _doc_id(document)
+                if doc_id not in self._ids:
+                    unique_docs.setdefault(doc_id, i)
+            if not unique_docs:
+                logger.info("Все документы уже есть в базе")
+                return True
+            positions = list(unique_docs.values())
+            texts = [documents[i] for i in positions]
+            metadatas = [metadata_list[i] for i in positions] if metadata_list is not None else [{} for _ in positions]
+            
+            embeddings = self.embedder.encode(
+                texts,
+                batch_size=max(1, min(len(texts), batch_size)),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            ).astype("float32")
+            self._faiss.normalize_L2(embeddings)
+            
+            # Плоский индекс не перестраивается при вставке: векторы просто дописываются
+            if self.index is None:
+                self.index = self._faiss.IndexFlatIP(embeddings.shape[1])
+            self._save(embeddings, texts, metadatas)
+            self.index.add(embeddings)
+            self.documents.extend(texts)
+            self.metadatas.extend(metadatas)
+            self._ids.update(unique_docs)
+            logger.info(f"✅ Добавлено {len(texts)} документов")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка при добавлении документов: {e}")
+            return False
+    
+    def search_similar(self, query, top_k=TOP_K_RESULTS):
+        try:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            
+            query_embedding = _encode_query(" ".join(query.split())).astype("float32")
+            self._faiss.normalize_L2(query_embedding)
+            _, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
+            
+            documents = [self.documents[i] for i in indices[0] if i >= 0]
+            logger.info(f"🔍 Найдено {len(documents)} релевантных документов")
+            return documents
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска: {e}")
+            return []
+    
+    def get_collection_info(self):
+        return {"document_count": len(self.documents)}
+
+def create_vector_store():
+    """Хранилище векторов по VECTOR_BACKEND"""
+    if VECTOR_BACKEND == "faiss":
+        return FAISSVectorStore()
+    return VectorStore()